@@ -0,0 +1,52 @@
+"""
+Compare jellyroll's date parsing with the old dateutil-based version.
+
+    $ PYTHONPATH=src python benchmarks/bench_dates.py [iterations]
+
+"cold" times each distinct string parsed once (no memo hits); "feed" times a
+more realistic run where the same timestamps turn up again and again.
+"""
+
+import os
+import sys
+import timeit
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "jellyroll.testsettings")
+
+import dateutil.parser
+import dateutil.tz
+from jellyroll.providers.utils import dates
+
+SAMPLES = [
+    "2009-08-18T15:30:16Z",                 # delicious
+    "2009-08-18",                           # delicious posts/dates
+    "2009-07-21 11:45:06",                  # flickr datetaken
+    "2009-08-18T15:30:16.000-07:00",        # ISO with offset
+    "Tue, 18 Aug 2009 15:30:16 +0000",      # twitter pubDate
+]
+
+def old_parsedate(s):
+    dt = dateutil.parser.parse(s)
+    if dt.tzinfo:
+        dt = dt.astimezone(dateutil.tz.tzlocal()).replace(tzinfo=None)
+    return dt
+
+def new_parsedate_cold(s):
+    dates._memo.clear()
+    return dates.parsedate(s)
+
+def run(name, func, iterations):
+    timer = timeit.Timer(lambda: [func(s) for s in SAMPLES])
+    best = min(timer.repeat(3, iterations))
+    print "%-12s %8.2f usec/date" % (name, best * 1e6 / (iterations * len(SAMPLES)))
+
+def main():
+    iterations = len(sys.argv) > 1 and int(sys.argv[1]) or 2000
+    for s in SAMPLES:
+        assert old_parsedate(s) == dates.parsedate(s), s
+    run("dateutil", old_parsedate, iterations)
+    run("cold", new_parsedate_cold, iterations)
+    run("feed", dates.parsedate, iterations)
+
+if __name__ == "__main__":
+    main()
@@ -2,6 +2,7 @@ import django.forms
 from django.contrib import admin
 from jellyroll.models import Item, Bookmark, Track, Photo, WebSearch, Message
 from jellyroll.models import WebSearchResult, Video, CodeRepository, CodeCommit
+from jellyroll.models import SyncState
 
 class ItemAdmin(admin.ModelAdmin):
     date_hierarchy = 'timestamp'
@@ -55,6 +56,9 @@ class CodeCommitAdmin(admin.ModelAdmin):
     list_filter = ('repository',)
     search_fields = ('message',)
 
+class SyncStateAdmin(admin.ModelAdmin):
+    list_display = ('provider', 'last_timestamp', 'last_success')
+
 admin.site.register(Item, ItemAdmin)
 admin.site.register(Bookmark, BookmarkAdmin)
 admin.site.register(Track, TrackAdmin)
@@ -64,4 +68,5 @@ admin.site.register(Message, MessageAdmin)
 admin.site.register(Video, VideoAdmin)
 admin.site.register(CodeRepository, CodeRepositoryAdmin)
 admin.site.register(CodeCommit, CodeCommitAdmin)
+admin.site.register(SyncState, SyncStateAdmin)
 
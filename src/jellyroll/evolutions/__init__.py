@@ -8,4 +8,9 @@ SEQUENCE = [
     'item_url_max_length',
     'track_url_max_length',
     'photo_add_farm_id',
+    'item_add_source_key',
+    'item_timeline_indexes',
+    'item_add_object_pk',
+    'item_add_payload',
+    'item_add_rendered',
 ]
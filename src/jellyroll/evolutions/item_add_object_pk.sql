@@ -0,0 +1,5 @@
+ALTER TABLE jellyroll_item ADD COLUMN object_pk integer NULL;
+UPDATE jellyroll_item SET object_pk = object_id::integer
+    WHERE object_id ~ '^[0-9]{1,9}$'
+      AND content_type_id NOT IN (SELECT id FROM django_content_type WHERE app_label = 'jellyroll' AND model = 'photo');
+CREATE INDEX jellyroll_item_object_pk ON jellyroll_item (object_pk);
@@ -0,0 +1,2 @@
+ALTER TABLE jellyroll_item ADD COLUMN _payload text NOT NULL DEFAULT '';
+ALTER TABLE jellyroll_item ALTER COLUMN _payload DROP DEFAULT;
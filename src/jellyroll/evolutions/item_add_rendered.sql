@@ -0,0 +1,6 @@
+ALTER TABLE jellyroll_item ADD COLUMN rendered_html text NOT NULL DEFAULT '';
+ALTER TABLE jellyroll_item ADD COLUMN rendered_text text NOT NULL DEFAULT '';
+ALTER TABLE jellyroll_item ADD COLUMN rendered_version varchar(50) NOT NULL DEFAULT '';
+ALTER TABLE jellyroll_item ALTER COLUMN rendered_html DROP DEFAULT;
+ALTER TABLE jellyroll_item ALTER COLUMN rendered_text DROP DEFAULT;
+ALTER TABLE jellyroll_item ALTER COLUMN rendered_version DROP DEFAULT;
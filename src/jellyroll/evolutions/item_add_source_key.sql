@@ -0,0 +1,4 @@
+ALTER TABLE jellyroll_item ADD COLUMN source_key varchar(32) NOT NULL DEFAULT '';
+UPDATE jellyroll_item SET source_key = md5(source || chr(10) || source_id);
+ALTER TABLE jellyroll_item ALTER COLUMN source_key DROP DEFAULT;
+CREATE INDEX jellyroll_item_source_key ON jellyroll_item (source_key);
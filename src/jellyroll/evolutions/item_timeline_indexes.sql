@@ -0,0 +1,3 @@
+CREATE INDEX jellyroll_item_timestamp ON jellyroll_item (timestamp);
+CREATE INDEX jellyroll_item_content_type_id_timestamp ON jellyroll_item (content_type_id, timestamp);
+CREATE INDEX jellyroll_item_source_timestamp ON jellyroll_item (source, timestamp);
@@ -0,0 +1,34 @@
+import optparse
+from django.core.management.base import BaseCommand
+from jellyroll.managers import snippet_version
+from jellyroll.models import Item
+
+class Command(BaseCommand):
+    help = "Render and store Items' snippets (for JELLYROLL_PRERENDER)."
+    
+    option_list = BaseCommand.option_list + (
+        optparse.make_option(
+            "-a", "--all", 
+            action="store_true", 
+            help="Re-render every Item, not just ones rendered for an old JELLYROLL_SNIPPET_VERSION."
+        ),
+        optparse.make_option(
+            "-c", "--chunk-size",
+            dest="chunk_size",
+            type="int",
+            default=500,
+            help="Render this many Items at a time (default: 500)."
+        ),
+    )
+    
+    def handle(self, *args, **options):
+        qs = Item.objects.all()
+        if not options.get('all'):
+            qs = qs.exclude(rendered_version=snippet_version())
+        ids = list(qs.order_by().values_list('id', flat=True))
+        
+        chunk_size = options.get('chunk_size') or 500
+        for start in range(0, len(ids), chunk_size):
+            Item.objects.prerender(ids[start:start+chunk_size])
+            if options.get('verbosity', '1') != '0':
+                print "Rendered %s of %s items" % (min(start+chunk_size, len(ids)), len(ids))
@@ -16,6 +16,13 @@ class Command(BaseCommand):
             action="store_true", 
             help="Display a list of active data providers."
         ),
+        optparse.make_option(
+            "-j", "--jobs",
+            dest="jobs",
+            type="int",
+            default=1,
+            help="Run up to this many providers at once (default: 1)."
+        ),
     )
     
     def handle(self, *args, **options):
@@ -37,7 +44,7 @@ class Command(BaseCommand):
                     self.print_providers()
                     return 0
 
-        jellyroll.providers.update(options['providers'])
+        jellyroll.providers.update(options['providers'], jobs=options['jobs'])
 
     def available_providers(self):
         return jellyroll.providers.active_providers()
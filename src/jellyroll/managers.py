@@ -1,38 +1,668 @@
 import datetime
-from django.db import models
+import hashlib
+import threading
+import time
+from django.core.cache import cache
+from django.db import models, connection, transaction
+from django.db.backends.util import typecast_timestamp
 from django.db.models import signals
+from django.db.models.query import QuerySet
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.utils.encoding import force_unicode
+from django.utils import simplejson
+from django.utils.datastructures import SortedDict
+from django.utils.encoding import force_unicode, smart_unicode, smart_str
+from tagging import settings as tagging_settings
 from tagging.fields import TagField
+from tagging.models import Tag, TaggedItem
+from tagging.utils import parse_tag_input
+
+def source_key(source, source_id):
+    """
+    Return the digest of an Item's (source, source_id) that's stored (and
+    indexed) in Item.source_key.
+    """
+    return hashlib.md5("%s\n%s" % (smart_str(source), smart_str(source_id))).hexdigest()
+
+def object_pk(model, pk):
+    """
+    Return the value for Item.object_pk: the primary key as an int if
+    ``model`` has an integer primary key, otherwise ``None``.
+    """
+    if pk is None or not isinstance(model._meta.pk, (models.AutoField, models.IntegerField)):
+        return None
+    try:
+        return int(pk)
+    except (TypeError, ValueError):
+        return None
+
+def tag_names(tags):
+    """
+    Return the set of tag names django-tagging would store for a tag string.
+    """
+    names = parse_tag_input(tags or "")
+    if tagging_settings.FORCE_LOWERCASE_TAGS:
+        names = [name.lower() for name in names]
+    return set(names)
+
+# Cache key for the Item generation number; see items_generation().
+GENERATION_KEY = "jellyroll.items.generation"
+
+def items_generation():
+    """
+    Return a number that changes whenever Items are created, changed or
+    deleted. Include it in the cache keys of anything computed from Items,
+    and those entries go stale by themselves.
+    
+    The generation lives in the Django cache, so it's only seen to move by
+    processes sharing that cache. Items are usually ingested by a cron job
+    (``jellyroll_update``), not the web server, so use a shared backend
+    (memcached, database, file) rather than ``locmem://`` if you cache
+    anything keyed on it; otherwise cached results only go stale when they
+    time out.
+    """
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Start from the clock, not 0, so an evicted generation can't come
+        # back and revive old entries.
+        generation = int(time.time() * 1000)
+        cache.add(GENERATION_KEY, generation)
+    return generation
+
+def items_changed(**kwargs):
+    """
+    Move on the Item generation. Connected to Item's post_save and
+    post_delete; the raw SQL paths in ItemManager call it themselves.
+    """
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, int(time.time() * 1000))
+
+def prerender_enabled():
+    """
+    Should Items' snippets be rendered (and stored) when they're ingested?
+    """
+    return getattr(settings, "JELLYROLL_PRERENDER", False)
+
+def snippet_version():
+    """
+    Return the current snippet template version. Bump JELLYROLL_SNIPPET_VERSION
+    when the snippet templates change, and every stored snippet goes stale.
+    """
+    return str(getattr(settings, "JELLYROLL_SNIPPET_VERSION", 1))
+
+def can_upsert():
+    """
+    Can the database do INSERT ... ON CONFLICT DO UPDATE? (SQLite 3.24+ and
+    PostgreSQL 9.5+ can.)
+    """
+    engine = settings.DATABASE_ENGINE
+    if engine == "sqlite3":
+        from sqlite3 import sqlite_version_info
+        return sqlite_version_info >= (3, 24)
+    if engine == "postgresql_psycopg2":
+        connection.cursor()
+        return getattr(connection.connection, "server_version", 0) >= 90500
+    return False
+
+def _can_return():
+    if settings.DATABASE_ENGINE == "sqlite3":
+        from sqlite3 import sqlite_version_info
+        return sqlite_version_info >= (3, 35)
+    return True
+
+def upsert(model, lookup, defaults, update=()):
+    """
+    Create an object, or update it if it already exists. Returns the object
+    and whether anything was written.
+    
+    ``lookup`` gives the values of a unique column (or columns) that
+    identify the object; ``defaults`` are the values of the other fields
+    for a new object, and ``update`` lists the fields that get overwritten
+    (with their values in ``defaults``) if the object already exists.
+    
+    Where the database supports it this is a single ``INSERT ... ON
+    CONFLICT DO UPDATE`` statement, so there's no window for another
+    process to create the object in between checking and inserting.
+    Elsewhere it falls back to ``get_or_create`` and ``save``. Like
+    ``QuerySet.update``, don't rely on it sending signals.
+    
+    Existing objects whose ``update`` fields already have the given values
+    aren't written to at all.
+    """
+    opts = model._meta
+    qn = connection.ops.quote_name
+    
+    if not can_upsert():
+        obj, created = model._default_manager.get_or_create(defaults=defaults, **lookup)
+        if created:
+            return obj, True
+        changed = _changed_fields(obj, defaults, update)
+        if changed:
+            for name in changed:
+                setattr(obj, name, defaults[name])
+            obj.save()
+        return obj, bool(changed)
+    
+    def prep(name, value):
+        field = opts.get_field(name)
+        if field.rel:
+            value = getattr(value, "pk", value)
+        return field.column, field.get_db_prep_save(value)
+    
+    # New rows get every field's default, just as if they were created
+    # through the ORM.
+    values = dict(lookup, **defaults)
+    for f in opts.fields:
+        if f.name not in values and not isinstance(f, models.AutoField):
+            values[f.name] = f.get_default()
+    columns, params = zip(*[prep(name, value) for name, value in values.items()])
+    conflict = [opts.get_field(name).column for name in lookup]
+    
+    # Only update rows that actually differ. (With nothing to update, the
+    # key column "update" never happens, which makes this DO NOTHING.)
+    assignments = [opts.get_field(name).column for name in update] or conflict[:1]
+    if settings.DATABASE_ENGINE == "sqlite3":
+        distinct = "IS NOT"
+    else:
+        distinct = "IS DISTINCT FROM"
+    sql = "INSERT INTO %s (%s) VALUES (%s) ON CONFLICT (%s) DO UPDATE SET %s WHERE %s" % (
+        qn(opts.db_table),
+        ", ".join([qn(c) for c in columns]),
+        ", ".join(["%s"] * len(columns)),
+        ", ".join([qn(c) for c in conflict]),
+        ", ".join(["%s = excluded.%s" % (qn(c), qn(c)) for c in assignments]),
+        " OR ".join(["%s.%s %s excluded.%s" % (qn(opts.db_table), qn(c), distinct, qn(c)) for c in assignments]),
+    )
+    
+    cursor = connection.cursor()
+    row = None
+    if _can_return():
+        sql += " RETURNING %s" % ", ".join([qn(f.column) for f in opts.fields])
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+        written = row is not None
+    else:
+        cursor.execute(sql, params)
+        written = cursor.rowcount > 0
+    if written:
+        transaction.commit_unless_managed()
+    if row is None:
+        return model._default_manager.get(**lookup), written
+    return model(*[f.to_python(value) for f, value in zip(opts.fields, row)]), written
+
+def _changed_fields(obj, values, names):
+    """
+    Return which of the fields ``names`` of ``obj`` differ from ``values``,
+    compared as the database would store them.
+    """
+    changed = []
+    for name in names:
+        prep = obj._meta.get_field(name).get_db_prep_save
+        if prep(getattr(obj, name)) != prep(values[name]):
+            changed.append(name)
+    return changed
+
+def _bounds_key(ctype_id):
+    return "jellyroll.bounds:%s" % (ctype_id or "all")
+
+def _as_datetime(d):
+    if not isinstance(d, datetime.datetime):
+        d = datetime.datetime.combine(d, datetime.time())
+    return d
+
+# Per-thread bookkeeping for ItemManager's post_save handling.
+_sync_state = threading.local()
+
+class ItemQuerySet(QuerySet):
+    """
+    A QuerySet of Items that can load the Items' objects in bulk; see
+    ``with_objects()``.
+    """
+    
+    # How many Items to load objects for at a time.
+    chunk_size = 500
+    
+    def __init__(self, *args, **kwargs):
+        super(ItemQuerySet, self).__init__(*args, **kwargs)
+        self._with_objects = False
+        
+    def with_objects(self):
+        """
+        Load each Item's ``object`` along with it: one query per content type
+        (per chunk of Items) instead of one per Item. Foreign keys of the
+        objects are followed too (with ``select_related``), so that things
+        like a commit's repository don't need queries of their own either.
+        """
+        clone = self._clone()
+        clone._with_objects = True
+        return clone
+        
+    def iterator(self):
+        if not self._with_objects:
+            for item in super(ItemQuerySet, self).iterator():
+                yield item
+            return
+        
+        chunk = []
+        for item in super(ItemQuerySet, self).iterator():
+            chunk.append(item)
+            if len(chunk) >= self.chunk_size:
+                attach_objects(chunk)
+                for item in chunk:
+                    yield item
+                chunk = []
+        attach_objects(chunk)
+        for item in chunk:
+            yield item
+            
+    def _clone(self, *args, **kwargs):
+        clone = super(ItemQuerySet, self)._clone(*args, **kwargs)
+        clone._with_objects = self._with_objects
+        return clone
+
+def attach_objects(items):
+    """
+    Fetch the objects for a list of Items, grouped by content type, and
+    cache them on the Items so that ``item.object`` doesn't hit the database.
+    """
+    by_ctype = {}
+    for item in items:
+        by_ctype.setdefault(item.content_type_id, []).append(item)
+    
+    for ctype_id, ctype_items in by_ctype.items():
+        ctype = ContentType.objects.get_for_id(ctype_id)
+        model = ctype.model_class()
+        if model is None:
+            continue
+        
+        # Use the integer object_pk where we have it, so the lookup can use
+        # the model's primary key index as-is.
+        keys = {}
+        for item in ctype_items:
+            key = item.object_pk
+            if key is None:
+                key = object_pk(model, item.object_id)
+            if key is None:
+                key = item.object_id
+            keys.setdefault(key, []).append(item)
+        
+        objects = model._default_manager.select_related().in_bulk(keys.keys())
+        for key, key_items in keys.items():
+            for item in key_items:
+                item._content_type_cache = ctype
+                if key in objects:
+                    item._object_cache = objects[key]
+
+class DeferredSync(object):
+    """
+    Context manager that holds back the Item updates for followed models
+    until the end of a block; see ``ItemManager.deferred_sync``.
+    """
+    
+    def __init__(self, manager):
+        self.manager = manager
+        
+    def __enter__(self):
+        # Nested blocks share the outermost block's queue.
+        if getattr(_sync_state, 'deferred', None) is None:
+            _sync_state.deferred = SortedDict()
+            _sync_state.depth = 0
+        _sync_state.depth += 1
+        return self
+        
+    def __exit__(self, exc_type, exc_value, traceback):
+        _sync_state.depth -= 1
+        if _sync_state.depth:
+            return
+        queued, _sync_state.deferred = _sync_state.deferred, None
+        if exc_type is None and queued:
+            self.manager.bulk_create_or_update([(instance, {}) for instance in queued.values()])
 
 class ItemManager(models.Manager):
     
     def __init__(self):
         super(ItemManager, self).__init__()
         self.models_by_name = {}
+        
+    def contribute_to_class(self, model, name):
+        super(ItemManager, self).contribute_to_class(model, name)
+        signals.post_save.connect(items_changed, sender=model)
+        signals.post_delete.connect(items_changed, sender=model)
+        signals.post_save.connect(self._bounds_post_save, sender=model)
+        signals.post_delete.connect(self._bounds_post_delete, sender=model)
+        
+    def get_query_set(self):
+        return ItemQuerySet(self.model)
+        
+    def with_objects(self):
+        """
+        Return Items with their objects loaded in bulk. See
+        ``ItemQuerySet.with_objects``.
+        """
+        return self.get_query_set().with_objects()
     
     def create_or_update(self, instance, timestamp=None, url=None, tags="", source="INTERACTIVE", source_id="", **kwargs):
         """
         Create or update an Item from some instace.
         """
-        # If the instance hasn't already been saved, save it first. This
-        # requires disconnecting the post-save signal that might be sent to
-        # this function (otherwise we could get an infinite loop).
-        if instance._get_pk_val() is None:
-            try:
-                signals.post_save.disconnect(self.create_or_update, sender=type(instance))
-            except Exception, err:
-                reconnect = False
-            else:
-                reconnect = True
-            instance.save()
-            if reconnect:
-                signals.post_save.connect(self.create_or_update, sender=type(instance))
+        self._save_instance(instance)
         
         # Make sure the item "should" be registered.
         if not getattr(instance, "jellyrollable", True):
             return
         
+        values, update_timestamp = self._item_values(instance, timestamp, url, tags, source, source_id)
+        ctype = ContentType.objects.get_for_model(instance)
+        object_id = force_unicode(instance._get_pk_val())
+        
+        # Existing Items keep their URL, and their timestamp unless we've
+        # been given a new one.
+        update = ['tags', 'source', 'source_id', 'source_key', 'object_str', 'object_pk', '_payload']
+        if update_timestamp:
+            update.append('timestamp')
+        
+        # Unchanged Items aren't written to at all.
+        if can_upsert():
+            item, written = upsert(self.model, dict(content_type=ctype, object_id=object_id), values, update)
+            if written:
+                items_changed()
+                self._extend_bounds(ctype.pk, [item.timestamp])
+                self.sync_tags(item, values['tags'])
+            if prerender_enabled():
+                if written or item.rendered_version != snippet_version():
+                    self.prerender([item.pk])
+            elif written:
+                # Like Item.save, don't leave a stale snippet looking current.
+                blank = dict(rendered_html="", rendered_text="", rendered_version="")
+                self.filter(pk=item.pk).update(**blank)
+                item.__dict__.update(blank)
+            return item
+            
+        # Otherwise create the Item object the slow way.
+        item, created = self.get_or_create(
+            content_type = ctype, 
+            object_id = object_id,
+            defaults = values,
+        )        
+        changed = []
+        if not created:
+            changed = _changed_fields(item, values, update)
+            if changed:
+                for name in changed:
+                    setattr(item, name, values[name])
+                item.save()
+        # (Item.save re-renders the Items it writes.)
+        if prerender_enabled() and item.rendered_version != snippet_version():
+            self.prerender([item.pk])
+        return item
+        
+    def bulk_create_or_update(self, instances, batch_size=500):
+        """
+        Create or update the Items for a whole batch of instances at once.
+        
+        ``instances`` is a list of ``(instance, kwargs)`` pairs, where
+        ``kwargs`` are the keyword arguments ``create_or_update`` would get
+        (``timestamp``, ``url``, ``tags``, ``source``, ``source_id``).
+        Existing Items are looked up with one query per content type (and
+        ``batch_size`` instances); new Items are inserted and changed ones
+        updated in batches, and tags are only rewritten for Items whose tags
+        actually changed. Items end up just as if ``create_or_update`` had
+        been called for each instance in turn.
+        
+        Where the database supports ``ON CONFLICT`` (see ``can_upsert``),
+        Items another process creates in the meantime are left as they are
+        rather than failing the insert.
+        
+        Returns the ids of the Items, in the same order as ``instances``
+        (``None`` for instances that aren't jellyrollable).
+        """
+        # Work out what every Item should look like, grouped by content type.
+        # If an instance turns up more than once the last one wins.
+        by_ctype = {}
+        order = []
+        for instance, kwargs in instances:
+            self._save_instance(instance)
+            if not getattr(instance, "jellyrollable", True):
+                order.append(None)
+                continue
+            values, update_timestamp = self._item_values(instance, **kwargs)
+            ctype = ContentType.objects.get_for_model(instance)
+            object_id = force_unicode(instance._get_pk_val())
+            by_ctype.setdefault(ctype.pk, {})[object_id] = (values, update_timestamp)
+            order.append((ctype.pk, object_id))
+        
+        ids = {}
+        for ctype_id, pending in by_ctype.items():
+            object_ids = pending.keys()
+            for start in range(0, len(object_ids), batch_size):
+                chunk = dict((object_id, pending[object_id]) for object_id in object_ids[start:start+batch_size])
+                ids.update(self._bulk_sync_chunk(ctype_id, chunk))
+        transaction.commit_unless_managed()
+        
+        return [key and ids[key] or None for key in order]
+        
+    def _bulk_sync_chunk(self, ctype_id, pending):
+        """
+        Sync one content type's worth of Items for ``bulk_create_or_update``.
+        ``pending`` maps object ids to ``(values, update_timestamp)``.
+        Returns a dict mapping ``(ctype_id, object_id)`` to Item ids.
+        """
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        fields = ('timestamp', 'url', 'tags', 'source', 'source_id', 'source_key', 'object_str', 'object_pk', '_payload')
+        prep = dict((name, opts.get_field(name).get_db_prep_save) for name in fields)
+        
+        existing = {}
+        rows = self.filter(content_type=ctype_id, object_id__in=pending.keys()).values('id', 'object_id', 'rendered_version', *fields)
+        for row in rows:
+            existing[row['object_id']] = row
+        
+        inserts, updates, retag, rerender, timestamps = [], [], [], [], []
+        for object_id, (values, update_timestamp) in pending.items():
+            row = existing.get(object_id)
+            if row is None:
+                inserts.append([ctype_id, object_id] + [prep[name](values[name]) for name in fields] + ["", "", ""])
+                timestamps.append(values['timestamp'])
+                if values['tags']:
+                    retag.append((object_id, values['tags']))
+                rerender.append(object_id)
+                continue
+            
+            # Existing Items keep their URL, and their timestamp unless we've
+            # been given a new one -- just like create_or_update.
+            names = [name for name in fields if name != 'url' and (name != 'timestamp' or update_timestamp)]
+            params = [prep[name](values[name]) for name in names]
+            if params == [prep[name](row[name]) for name in names]:
+                if row['rendered_version'] != snippet_version():
+                    rerender.append(object_id)
+                continue
+            if not prerender_enabled():
+                # Like Item.save, don't leave a stale snippet looking current.
+                names.extend(['rendered_html', 'rendered_text', 'rendered_version'])
+                params.extend(["", "", ""])
+            updates.append((tuple(names), params + [row['id']]))
+            rerender.append(object_id)
+            if update_timestamp:
+                timestamps.append(values['timestamp'])
+            if values['tags'] != row['tags']:
+                retag.append((object_id, values['tags']))
+        
+        cursor = connection.cursor()
+        if inserts:
+            columns = [opts.get_field('content_type').column, opts.get_field('object_id').column]
+            columns.extend(opts.get_field(name).column for name in fields)
+            columns.extend(opts.get_field(name).column for name in ('rendered_html', 'rendered_text', 'rendered_version'))
+            sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+                qn(opts.db_table), 
+                ", ".join([qn(c) for c in columns]), 
+                ", ".join(["%s"] * len(columns))
+            )
+            # Another process may have created some of these Items since we
+            # looked; where we can, leave those be instead of failing the
+            # whole chunk on the unique constraint. Their ids are looked up
+            # below along with the rest.
+            if can_upsert():
+                sql += " ON CONFLICT (%s) DO NOTHING" % ", ".join([qn(c) for c in columns[:2]])
+            cursor.executemany(sql, inserts)
+        
+        # Updates that touch the same columns share a statement.
+        by_names = {}
+        for names, params in updates:
+            by_names.setdefault(names, []).append(params)
+        for names, batch in by_names.items():
+            cursor.executemany("UPDATE %s SET %s WHERE %s = %%s" % (
+                qn(opts.db_table), 
+                ", ".join(["%s = %%s" % qn(opts.get_field(name).column) for name in names]),
+                qn(opts.pk.column),
+            ), batch)
+        
+        if inserts or updates:
+            items_changed()
+            self._extend_bounds(ctype_id, timestamps)
+        
+        ids = dict((object_id, row['id']) for object_id, row in existing.items())
+        if inserts:
+            new_ids = [params[1] for params in inserts]
+            ids.update(self.filter(content_type=ctype_id, object_id__in=new_ids).values_list('object_id', 'id'))
+        
+        if retag:
+            self.bulk_sync_tags(dict((ids[object_id], tags) for object_id, tags in retag))
+        if prerender_enabled() and rerender:
+            self.prerender([ids[object_id] for object_id in rerender])
+        
+        return dict(((ctype_id, object_id), id) for object_id, id in ids.items() if object_id in pending)
+        
+    def prerender(self, ids, batch_size=100):
+        """
+        Render the HTML and text snippets of some Items (given by id), and
+        store them on the Items along with the current snippet version, so
+        that ``jellyrender`` can serve them as-is. Objects are loaded (and
+        the results written) ``batch_size`` Items at a time.
+        
+        Snippets are rendered with a plain Context, without any request
+        context processors.
+        """
+        from jellyroll.templatetags.jellyroll import render_item, TEXT_SNIPPET
+        
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        version = snippet_version()
+        cursor = connection.cursor()
+        ids = list(ids)
+        for start in range(0, len(ids), batch_size):
+            rows = []
+            for item in self.with_objects().filter(pk__in=ids[start:start+batch_size]):
+                html = render_item(item, stored=False)
+                text = render_item(item, using=TEXT_SNIPPET, stored=False)
+                rows.append((html, text, version, item.pk))
+            cursor.executemany("UPDATE %s SET %s = %%s, %s = %%s, %s = %%s WHERE %s = %%s" % (
+                qn(opts.db_table), 
+                qn(opts.get_field('rendered_html').column), 
+                qn(opts.get_field('rendered_text').column), 
+                qn(opts.get_field('rendered_version').column), 
+                qn(opts.pk.column),
+            ), rows)
+        items_changed()
+        transaction.commit_unless_managed()
+        
+    def sync_tags(self, item, tags):
+        """
+        Set the tags of an Item (or Item id). See ``bulk_sync_tags``.
+        """
+        self.bulk_sync_tags({getattr(item, 'pk', item): tags})
+        
+    def bulk_sync_tags(self, tags_by_id, batch_size=500):
+        """
+        Set the tags of many Items at once. ``tags_by_id`` maps Item ids to
+        tag strings.
+        
+        Unlike ``Tag.objects.update_tags`` (which makes a handful of queries
+        per new tag) the tag strings are diffed against the Items' current
+        tags, and only the difference is written: one query per
+        ``batch_size`` Items to read the current tags, one to look up the
+        Tags being added, and one batch each of deletes and inserts. Items
+        whose tags haven't changed cost just the read.
+        """
+        ctype = ContentType.objects.get_for_model(self.model)
+        wanted = dict((int(id), tag_names(tags)) for id, tags in tags_by_id.items())
+        
+        current = dict((id, {}) for id in wanted)
+        idlist = wanted.keys()
+        for start in range(0, len(idlist), batch_size):
+            rows = TaggedItem.objects.filter(content_type=ctype, object_id__in=idlist[start:start+batch_size])
+            for object_id, name, tagged_id in rows.values_list('object_id', 'tag__name', 'id'):
+                current[object_id][name] = tagged_id
+        
+        stale, missing = [], []
+        for id, names in wanted.items():
+            stale.extend(tagged_id for name, tagged_id in current[id].items() if name not in names)
+            missing.extend((id, name) for name in names if name not in current[id])
+        if not (stale or missing):
+            return
+        
+        qn = connection.ops.quote_name
+        opts = TaggedItem._meta
+        cursor = connection.cursor()
+        for start in range(0, len(stale), batch_size):
+            batch = stale[start:start+batch_size]
+            cursor.execute("DELETE FROM %s WHERE %s IN (%s)" % (
+                qn(opts.db_table), 
+                qn(opts.pk.column), 
+                ", ".join(["%s"] * len(batch))
+            ), batch)
+        
+        if missing:
+            tag_ids = self._tag_ids(set(name for id, name in missing), batch_size)
+            cursor.executemany("INSERT INTO %s (%s, %s, %s) VALUES (%%s, %%s, %%s)" % (
+                qn(opts.db_table), 
+                qn(opts.get_field('tag').column), 
+                qn(opts.get_field('content_type').column), 
+                qn(opts.get_field('object_id').column),
+            ), [(tag_ids[name], ctype.pk, id) for id, name in missing])
+        transaction.commit_unless_managed()
+        
+    def _tag_ids(self, names, batch_size=500):
+        """
+        Return a dict mapping tag names to Tag ids, creating the Tags that
+        don't exist yet.
+        """
+        ids = {}
+        names = list(names)
+        for start in range(0, len(names), batch_size):
+            ids.update(Tag.objects.filter(name__in=names[start:start+batch_size]).values_list('name', 'id'))
+        
+        # New Tags are created one at a time. Another process (a provider
+        # running alongside this one, say) may be creating the same Tag, and
+        # get_or_create copes with that in a savepoint, where a failed batch
+        # insert would spoil the whole transaction.
+        for name in names:
+            if name not in ids:
+                ids[name] = Tag.objects.get_or_create(name=name)[0].pk
+        return ids
+        
+    def _save_instance(self, instance):
+        """
+        Save an instance that hasn't been saved yet, so its Item has
+        something to point at.
+        """
+        # The save sends post_save, which would call create_or_update for
+        # the same instance again. Mark the instance as being saved (in this
+        # thread only) so the signal handler leaves it alone.
+        if instance._get_pk_val() is None:
+            saving = _sync_state.__dict__.setdefault('saving', set())
+            saving.add(id(instance))
+            try:
+                instance.save()
+            finally:
+                saving.discard(id(instance))
+        
+    def _item_values(self, instance, timestamp=None, url=None, tags="", source="INTERACTIVE", source_id=""):
+        """
+        Work out the fields of an instance's Item. Returns a dict of values
+        and whether the timestamp should be updated on an existing Item.
+        """
         # Check to see if the timestamp is being updated, possibly pulling
         # the timestamp from the instance.
         if hasattr(instance, "timestamp"):
@@ -53,36 +683,230 @@ class ItemManager(models.Manager):
         if not url:
             if hasattr(instance,'url'):
                 url = instance.url
+        
+        # Display data for snippets, if the model provides it.
+        payload = ""
+        if hasattr(instance, "jellyroll_payload"):
+            payload = instance.jellyroll_payload()
+            payload = payload and simplejson.dumps(payload) or ""
 
-        # Create the Item object.
-        ctype = ContentType.objects.get_for_model(instance)
-        item, created = self.get_or_create(
-            content_type = ctype, 
-            object_id = force_unicode(instance._get_pk_val()),
-            defaults = dict(
-                timestamp = timestamp,
-                source = source,
-                source_id = source_id,
-                tags = tags,
-                url = url,
-            )
-        )        
-        item.tags = tags
-        item.source = source
-        item.source_id = source_id
-        if update_timestamp:
-            item.timestamp = timestamp
-            
-        # Save and return the item.
-        item.save()
-        return item
+        values = dict(
+            object_str = smart_unicode(instance),
+            object_pk = object_pk(type(instance), instance._get_pk_val()),
+            timestamp = timestamp,
+            source = source,
+            source_id = source_id,
+            source_key = source_key(source, source_id),
+            tags = tags,
+            url = url,
+            _payload = payload,
+        )
+        return values, update_timestamp
         
     def follow_model(self, model):
         """
         Follow a particular model class, updating associated Items automatically.
         """
         self.models_by_name[model.__name__.lower()] = model
-        signals.post_save.connect(self.create_or_update, sender=model)
+        signals.post_save.connect(self._post_save, sender=model)
+        
+    def _post_save(self, sender, instance, **kwargs):
+        """
+        post_save handler for followed models.
+        """
+        if id(instance) in getattr(_sync_state, 'saving', ()):
+            return
+        deferred = getattr(_sync_state, 'deferred', None)
+        if deferred is not None:
+            deferred[(type(instance), instance._get_pk_val())] = instance
+            return
+        self.create_or_update(instance)
+        
+    def deferred_sync(self):
+        """
+        Defer the Item updates for saves of followed models until the end of
+        a block, and then do them all at once with ``bulk_create_or_update``::
+        
+            with Item.objects.deferred_sync():
+                for b in Bookmark.objects.all():
+                    b.description = b.description.strip()
+                    b.save()
+        
+        An object that's saved more than once in the block only gets synced
+        once, from the last save. Blocks can be nested; everything is synced
+        when the outermost one ends. If the block raises, the queued updates
+        are dropped, like the transaction they'd usually be part of.
+        
+        Only post_save-triggered updates are deferred (and only in the
+        current thread); explicit ``create_or_update`` calls happen at once.
+        """
+        return DeferredSync(self)
+        
+    def for_source(self, source, source_id):
+        """
+        Return a QuerySet of the Items with a given source and source_id.
+        """
+        return self.filter(source_key=source_key(source, source_id), source=source, source_id=source_id)
+        
+    def existing_source_ids(self, source, ids, batch_size=500):
+        """
+        Return the set of ``ids`` that there are already Items for from a
+        given source. Takes one query per ``batch_size`` ids.
+        """
+        keys = dict((source_key(source, id), force_unicode(id)) for id in ids)
+        found = set()
+        keylist = keys.keys()
+        for start in range(0, len(keylist), batch_size):
+            rows = self.filter(source=source, source_key__in=keylist[start:start+batch_size])
+            for key, source_id in rows.values_list('source_key', 'source_id'):
+                if keys[key] == source_id:
+                    found.add(source_id)
+        return found
+        
+    def get_for_object(self, obj):
+        """
+        Return the Item for an object. Raises DoesNotExist if there isn't one.
+        """
+        ctype = ContentType.objects.get_for_model(obj)
+        pk = object_pk(type(obj), obj._get_pk_val())
+        if pk is not None:
+            try:
+                return self.get(content_type=ctype, object_pk=pk)
+            except self.model.DoesNotExist:
+                # Items from before object_pk was added only have it if the
+                # backfill (PostgreSQL only) was run; look them up the old way.
+                pass
+        return self.get(content_type=ctype, object_id=force_unicode(obj._get_pk_val()))
+        
+    def daily_counts(self, start, end, models=None):
+        """
+        Count Items per day and content type, for ``start <= timestamp <
+        end``, in a single grouped query. ``models`` optionally limits the
+        count to some models. Returns a dict mapping ``(date,
+        content_type_id)`` to a count; days without Items are left out.
+        """
+        opts = self.model._meta
+        qn = connection.ops.quote_name
+        timestamp = "%s.%s" % (qn(opts.db_table), qn(opts.get_field('timestamp').column))
+        ctype = "%s.%s" % (qn(opts.db_table), qn(opts.get_field('content_type').column))
+        day = connection.ops.date_trunc_sql('day', timestamp)
+        
+        where = ["%s >= %%s" % timestamp, "%s < %%s" % timestamp]
+        params = [connection.ops.value_to_db_datetime(_as_datetime(start)),
+                  connection.ops.value_to_db_datetime(_as_datetime(end))]
+        if models is not None:
+            ctype_ids = [ContentType.objects.get_for_model(m).pk for m in models]
+            if not ctype_ids:
+                return {}
+            where.append("%s IN (%s)" % (ctype, ", ".join(["%s"] * len(ctype_ids))))
+            params.extend(ctype_ids)
+            
+        cursor = connection.cursor()
+        cursor.execute("SELECT %s, %s, COUNT(*) FROM %s WHERE %s GROUP BY %s, %s" % (
+            day, ctype, qn(opts.db_table), " AND ".join(where), day, ctype
+        ), params)
+        
+        counts = {}
+        for day, ctype_id, count in cursor.fetchall():
+            if isinstance(day, basestring):
+                day = typecast_timestamp(day)
+            if isinstance(day, datetime.datetime):
+                day = day.date()
+            counts[(day, ctype_id)] = counts.get((day, ctype_id), 0) + count
+        return counts
+        
+    def get_for_objects(self, objects, batch_size=500):
+        """
+        Return the Items for a list of objects, in the same order (``None``
+        for objects without one). Takes one query per content type (and
+        ``batch_size`` objects), and the Items come with their objects
+        already attached.
+        """
+        by_ctype = {}
+        for obj in objects:
+            by_ctype.setdefault(type(obj), []).append(obj)
+        
+        found = {}
+        for model, objs in by_ctype.items():
+            ctype = ContentType.objects.get_for_model(model)
+            keys = dict((object_pk(model, obj._get_pk_val()), obj) for obj in objs)
+            if None not in keys:
+                self._find_objects(found, ctype, 'object_pk', keys, batch_size)
+                # Items from before object_pk was added only have it if the
+                # backfill (PostgreSQL only) was run; look them up the old way.
+                objs = [obj for obj in objs if (model, obj._get_pk_val()) not in found]
+            keys = dict((force_unicode(obj._get_pk_val()), obj) for obj in objs)
+            self._find_objects(found, ctype, 'object_id', keys, batch_size)
+        return [found.get((type(obj), obj._get_pk_val())) for obj in objects]
+        
+    def _find_objects(self, found, ctype, field, keys, batch_size):
+        """
+        Look up the Items whose ``field`` is one of the keys of ``keys`` (a
+        dict mapping them to objects), adding them to ``found``.
+        """
+        keylist = keys.keys()
+        for start in range(0, len(keylist), batch_size):
+            lookup = {'content_type': ctype, '%s__in' % field: keylist[start:start+batch_size]}
+            for item in self.filter(**lookup).order_by():
+                obj = keys[getattr(item, field)]
+                item._content_type_cache = ctype
+                item._object_cache = obj
+                found[(type(obj), obj._get_pk_val())] = item
+        
+    def timeline_bounds(self, model=None):
+        """
+        Return the timestamps of the first and last Items (of a given model,
+        if ``model`` is given) as a ``(first, last)`` tuple, or ``None`` if
+        there aren't any Items.
+        
+        The bounds are cached, and only looked up again when an Item is saved
+        outside them or the first or last Item is deleted. (Moving the first
+        or last Item's timestamp inwards leaves them a little too wide until
+        the cache entry expires.)
+        """
+        ctype_id = None
+        if model is not None:
+            ctype_id = ContentType.objects.get_for_model(model).pk
+        key = _bounds_key(ctype_id)
+        bounds = cache.get(key)
+        if bounds is None:
+            qs = self.all()
+            if ctype_id is not None:
+                qs = qs.filter(content_type=ctype_id)
+            qs = qs.values_list('timestamp', flat=True)
+            first = list(qs.order_by('timestamp')[:1])
+            last = list(qs.order_by('-timestamp')[:1])
+            bounds = first and (first[0], last[0]) or ()
+            cache.set(key, bounds)
+        return bounds or None
+        
+    def _extend_bounds(self, ctype_id, timestamps):
+        """
+        Make sure the cached timeline bounds take in some new timestamps.
+        
+        Bounds that need widening are dropped (and looked up again next time)
+        rather than rewritten: a get-then-set isn't atomic, so two processes
+        widening them at once could otherwise lose one of the widenings.
+        """
+        if not timestamps:
+            return
+        first, last = min(timestamps), max(timestamps)
+        for key in (_bounds_key(None), _bounds_key(ctype_id)):
+            bounds = cache.get(key)
+            if bounds is None:
+                continue
+            if not bounds or first < bounds[0] or last > bounds[1]:
+                cache.delete(key)
+            
+    def _bounds_post_save(self, sender, instance, **kwargs):
+        self._extend_bounds(instance.content_type_id, [instance.timestamp])
+        
+    def _bounds_post_delete(self, sender, instance, **kwargs):
+        # Only the first or last Item going makes a difference.
+        for key in (_bounds_key(None), _bounds_key(instance.content_type_id)):
+            bounds = cache.get(key)
+            if bounds and instance.timestamp in bounds:
+                cache.delete(key)
         
     def get_for_model(self, model):
         """
@@ -102,3 +926,21 @@ class ItemManager(models.Manager):
             return qs.order_by('-timestamp')[0].timestamp
         except IndexError:
             return datetime.datetime.fromtimestamp(0)
+
+
+class SyncStateManager(models.Manager):
+    
+    def get_for_provider(self, provider, model=None, **kwargs):
+        """
+        Return the SyncState for a given provider, creating it if needed.
+        
+        If the provider has never recorded a high-water timestamp and a
+        ``model`` is given, the timestamp is seeded from the newest Item of
+        that model (``kwargs`` further filter those Items). That scan only
+        ever happens once per provider.
+        """
+        state, created = self.get_or_create(provider=provider)
+        if state.last_timestamp is None and model is not None:
+            Item = models.get_model("jellyroll", "item")
+            state.last_timestamp = Item.objects.get_last_update_of_model(model, **kwargs)
+        return state
@@ -1,3 +1,4 @@
+import datetime
 import urllib
 import urlparse
 from django.conf import settings
@@ -6,9 +7,34 @@ from django.contrib.contenttypes import generic
 from django.db import models
 from django.utils import simplejson, text
 from django.utils.encoding import smart_unicode
-from jellyroll.managers import ItemManager
+from jellyroll.managers import ItemManager, SyncStateManager, object_pk, source_key, prerender_enabled
 from tagging.fields import TagField
 
+class ItemTagField(TagField):
+    """
+    The TagField for Item.tags. Tags are synced with ``ItemManager.sync_tags``,
+    and only when they differ from what the Item was loaded (or last saved)
+    with -- so re-saving an Item doesn't rewrite its tags.
+    """
+    
+    def __set__(self, instance, value):
+        super(ItemTagField, self).__set__(instance, value)
+        # The first set comes from Model.__init__: that's the saved value.
+        if not hasattr(instance, self._saved_attname()):
+            setattr(instance, self._saved_attname(), self._get_instance_tag_cache(instance))
+            
+    def _save(self, **kwargs):
+        instance = kwargs['instance']
+        tags = self._get_instance_tag_cache(instance)
+        if tags is None:
+            return
+        if kwargs.get('created') or tags != getattr(instance, self._saved_attname(), None):
+            type(instance)._default_manager.sync_tags(instance, tags)
+            setattr(instance, self._saved_attname(), tags)
+            
+    def _saved_attname(self):
+        return '_%s_saved' % self.attname
+
 class Item(models.Model):
     """
     A generic jellyroll item. Slightly denormalized for performance.
@@ -19,21 +45,51 @@ class Item(models.Model):
     object_id = models.TextField()
     object = generic.GenericForeignKey('content_type', 'object_id')
     
+    # The same key as an integer, for the (many) models with integer primary
+    # keys, so that lookups and joins against them can use their indexes.
+    object_pk = models.IntegerField(null=True, blank=True, db_index=True, editable=False)
+    
     # "Standard" metadata each object provides.
     url = models.URLField(blank=True, max_length=1000)
-    timestamp = models.DateTimeField()
-    tags = TagField(max_length=2500)
+    timestamp = models.DateTimeField(db_index=True)
+    tags = ItemTagField(max_length=2500)
     
     # Metadata about where the object "came from" -- used by data providers to
     # figure out which objects to update when asked.
     source = models.CharField(max_length=100, blank=True)
     source_id = models.TextField(blank=True)
     
+    # Digest of (source, source_id), so that "have we seen this before?"
+    # lookups can use an index.
+    source_key = models.CharField(max_length=32, blank=True, db_index=True, editable=False)
+    
     # Denormalized object __unicode__, for performance 
     object_str = models.TextField(blank=True)
     
+    # Denormalized display data from the object's jellyroll_payload() method,
+    # so snippets can render the item without loading the object.
+    _payload = models.TextField(blank=True, editable=False)
+    def _set_payload(self, d):
+        self._payload = d and simplejson.dumps(d) or ""
+    def _get_payload(self):
+        if self._payload:
+            return simplejson.loads(self._payload)
+        else:
+            return {}
+    payload = property(_get_payload, _set_payload, "Display data for the object, as a dict.")
+    
+    # Snippet output rendered at ingest time when JELLYROLL_PRERENDER is on,
+    # and the JELLYROLL_SNIPPET_VERSION it was rendered for. jellyrender
+    # serves these for as long as the version matches.
+    rendered_html = models.TextField(blank=True, editable=False)
+    rendered_text = models.TextField(blank=True, editable=False)
+    rendered_version = models.CharField(max_length=50, blank=True, editable=False)
+    
     objects = ItemManager()
     
+    # Besides the indexes declared here, sql/item.sql adds composite
+    # (content_type, timestamp) and (source, timestamp) indexes for the
+    # timeline queries.
     class Meta:
         ordering = ['-timestamp']
         unique_together = [("content_type", "object_id")]
@@ -47,7 +103,68 @@ class Item(models.Model):
     def save(self, *args, **kwargs):
         ct = "%s_%s" % (self.content_type.app_label, self.content_type.model.lower())
         self.object_str = smart_unicode(self.object)
+        self.object_pk = object_pk(self.content_type.model_class(), self.object_id)
+        self.source_key = source_key(self.source, self.source_id)
+        if hasattr(self.object, "jellyroll_payload"):
+            self.payload = self.object.jellyroll_payload()
+        
+        # Whatever changed, stored snippets are now out of date.
+        self.rendered_html = self.rendered_text = self.rendered_version = ""
         super(Item, self).save(*args, **kwargs)
+        if prerender_enabled():
+            Item.objects.prerender([self.pk])
+            rendered = Item.objects.filter(pk=self.pk).values('rendered_html', 'rendered_text', 'rendered_version')[0]
+            for name, value in rendered.items():
+                setattr(self, name, value)
+
+class SyncState(models.Model):
+    """
+    Where a data provider left off. Providers read this to figure out where
+    to resume, and update it in the same transaction as the items they
+    ingest.
+    """
+    
+    provider        = models.CharField(max_length=250, unique=True)
+    last_timestamp  = models.DateTimeField(blank=True, null=True)
+    last_success    = models.DateTimeField(blank=True, null=True)
+    
+    # Opaque, provider-specific resume data (a page, a revision, an id...)
+    _cursor = models.TextField(blank=True)
+    def _set_cursor(self, d):
+        if d:
+            self._cursor = simplejson.dumps(d)
+        else:
+            self._cursor = ''
+    def _get_cursor(self):
+        if self._cursor:
+            return simplejson.loads(self._cursor)
+        else:
+            return {}
+    cursor = property(_get_cursor, _set_cursor, "Provider resume data, as a dict.")
+    
+    objects = SyncStateManager()
+    
+    def __unicode__(self):
+        return self.provider
+    
+    def advance(self, timestamp=None, cursor=None, success=False):
+        """
+        Record progress and save. The high-water timestamp only ever moves
+        forward; ``cursor`` replaces the stored cursor if given.
+        """
+        if timestamp is not None and timestamp.tzinfo is not None:
+            # Timestamps come back out of the database local and naive, so
+            # store them that way too (converting, not just dropping the
+            # zone, or an aware UTC timestamp would be hours out).
+            from jellyroll.providers.utils.dates import to_local
+            timestamp = to_local(timestamp)
+        if timestamp is not None and (self.last_timestamp is None or timestamp > self.last_timestamp):
+            self.last_timestamp = timestamp
+        if cursor is not None:
+            self.cursor = cursor
+        if success:
+            self.last_success = datetime.datetime.now()
+        self.save()
 
 class Bookmark(models.Model):
     """
@@ -63,6 +180,9 @@ class Bookmark(models.Model):
     
     def __unicode__(self):
         return self.url
+        
+    def jellyroll_payload(self):
+        return {"description": self.description, "thumbnail_url": self.thumbnail_url}
 
 class Track(models.Model):
     """A track you listened to. The model is based on last.fm."""
@@ -75,6 +195,9 @@ class Track(models.Model):
     
     def __unicode__(self):
         return "%s - %s" % (self.artist_name, self.track_name)
+        
+    def jellyroll_payload(self):
+        return {"artist_name": self.artist_name, "track_name": self.track_name}
 
 CC_LICENSES = (
     ('http://creativecommons.org/licenses/by/2.0/',         'CC Attribution'),
@@ -137,6 +260,13 @@ class Photo(models.Model):
     def url(self):
         return "http://www.flickr.com/photos/%s/%s/" % (self.taken_by, self.photo_id)
     url = property(url)
+    
+    def jellyroll_payload(self):
+        return {
+            "title": self.title, 
+            "square_url": self.square_url, 
+            "thumbnail_url": self.thumbnail_url,
+        }
         
     def timestamp(self):
         return self.date_uploaded
@@ -233,6 +363,9 @@ class WebSearch(models.Model):
     def url(self):
         return self.engine.search_template % (urllib.quote_plus(self.query))
     url = property(url)
+    
+    def jellyroll_payload(self):
+        return {"query": self.query, "engine": self.engine.name}
         
 class WebSearchResult(models.Model):
     """
@@ -275,6 +408,9 @@ class Video(models.Model):
     def embed_url(self):
         return self.source.embed_template % self.docid
     embed_url = property(embed_url)
+    
+    def jellyroll_payload(self):
+        return {"title": self.title, "source": self.source.name, "embed_url": self.embed_url}
 
 SCM_CHOICES = (
     ("svn", "Subversion"),
@@ -329,6 +465,13 @@ class CodeCommit(models.Model):
         if self.repository.public_changeset_template:
             return self.repository.public_changeset_template % self.revision
         return ""
+        
+    def jellyroll_payload(self):
+        return {
+            "revision": self.format_revision(),
+            "repository": self.repository.name,
+            "repository_url": self.repository.url,
+        }
     
 class Message(models.Model):
     """
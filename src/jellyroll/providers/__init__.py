@@ -1,7 +1,11 @@
 import os
 import glob
 import logging
+import threading
+import Queue
 from django.conf import settings
+from django.db import connection
+from jellyroll.providers import utils
 
 try:
     set
@@ -40,33 +44,79 @@ def expand_star(mod_name):
         expanded.append('%s.%s' % (mod_name[:-2], f[:-3]))
     return expanded
     
-def update(providers):
+def update(providers, jobs=1):
     """
     Update a given set of providers. If the list is empty, it means update all
     of 'em.
+    
+    If ``jobs`` is greater than one, up to that many providers will be run at
+    the same time, each in its own thread.
     """
     active = active_providers()
     if providers is None:
         providers = active.keys()
     else:
         providers = set(active.keys()).intersection(providers)
-        
+    
+    if jobs > 1 and len(providers) > 1:
+        _update_concurrently(active, providers, jobs)
+    else:
+        for provider in providers:
+            _update_provider(active, provider)
+
+def _update_concurrently(active, providers, jobs):
+    """
+    Run providers using a bounded pool of worker threads.
+    """
+    queue = Queue.Queue()
     for provider in providers:
-        log.debug("Updating from provider %r", provider)
+        queue.put(provider)
+    
+    def worker():
         try:
-            mod = active[provider]
-        except KeyError:
-            log.error("Unknown provider: %r" % provider)
-            continue
+            while True:
+                try:
+                    provider = queue.get_nowait()
+                except Queue.Empty:
+                    break
+                _update_provider(active, provider)
+        finally:
+            # Each thread gets its own database connection; don't leak them.
+            connection.close()
+    
+    workers = [threading.Thread(target=worker) for i in range(min(jobs, len(providers)))]
+    for t in workers:
+        t.setDaemon(True)
+        t.start()
+    for t in workers:
+        # Join with a timeout so that ^C still reaches the main thread.
+        while t.isAlive():
+            t.join(1)
 
-        log.info("Running '%s.update()'", provider)
-        try:
-            mod.update()
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except Exception, e:
-            log.error("Failed during '%s.update()'", provider)
-            log.exception(e)
-            continue
+def _update_provider(active, provider):
+    """
+    Run a single provider, logging (and swallowing) any errors it raises so
+    that one broken provider doesn't stop the others.
+    """
+    log.debug("Updating from provider %r", provider)
+    try:
+        mod = active[provider]
+    except KeyError:
+        log.error("Unknown provider: %r" % provider)
+        return
+
+    log.info("Running '%s.update()'", provider)
+    utils.start_run()
+    try:
+        mod.update()
+    except (KeyboardInterrupt, SystemExit):
+        utils.finish_run(success=False)
+        raise
+    except Exception, e:
+        utils.finish_run(success=False)
+        log.error("Failed during '%s.update()'", provider)
+        log.exception(e)
+        return
+    utils.finish_run()
 
-        log.info("Done with provider %r", provider)
+    log.info("Done with provider %r", provider)
@@ -1,4 +1,3 @@
-import time
 import dateutil.parser
 import dateutil.tz
 import logging
@@ -6,7 +5,8 @@ import urllib
 from django.conf import settings
 from django.db import transaction
 from django.utils.encoding import smart_unicode
-from jellyroll.models import Item, Bookmark
+from jellyroll.managers import upsert
+from jellyroll.models import Item, Bookmark, SyncState
 from jellyroll.providers import utils
 
 #
@@ -17,8 +17,6 @@ class DeliciousClient(object):
     A super-minimal delicious client :)
     """
 
-    lastcall = 0
-
     def __init__(self, username, password, method='v1'):
         self.username, self.password = username, password
         self.method = method
@@ -30,13 +28,21 @@ class DeliciousClient(object):
         return "<DeliciousClient: %s>" % self.method
 
     def __call__(self, **params):
-        # Enforce Yahoo's "no calls quicker than every 1 second" rule
-        delta = time.time() - DeliciousClient.lastcall
-        if delta < 2:
-            time.sleep(2 - delta)
-        DeliciousClient.lastcall = time.time()
-        url = ("https://api.del.icio.us/%s?" % self.method) + urllib.urlencode(params)        
+        url = self._prepare(params)
         return utils.getxml(url, username=self.username, password=self.password)
+    
+    def iterate(self, tag, **params):
+        """
+        Call the method, but stream the response back one ``tag`` element at
+        a time instead of parsing it all up front.
+        """
+        url = self._prepare(params)
+        return utils.iterxml(url, tag, username=self.username, password=self.password)
+    
+    def _prepare(self, params):
+        # Enforce Yahoo's "no calls quicker than every 1 second" rule
+        utils.ratelimit("delicious")
+        return ("https://api.del.icio.us/%s?" % self.method) + urllib.urlencode(params)
 
 #
 # Public API
@@ -56,48 +62,57 @@ def update():
     delicious = DeliciousClient(settings.DELICIOUS_USERNAME, settings.DELICIOUS_PASSWORD)
 
     # Check to see if we need an update
-    last_update_date = Item.objects.get_last_update_of_model(Bookmark)
+    state = SyncState.objects.get_for_provider(__name__, Bookmark)
+    last_update_date = state.last_timestamp
     last_post_date = utils.parsedate(delicious.posts.update().get("time"))
     if last_post_date <= last_update_date:
         log.info("Skipping update: last update date: %s; last post date: %s", last_update_date, last_post_date)
+        state.advance(success=True)
         return
 
-    for datenode in reversed(list(delicious.posts.dates().getiterator('date'))):
-        dt = utils.parsedate(datenode.get("date"))
+    dates = [datenode.get("date") for datenode in delicious.posts.dates.iterate('date')]
+    for date in reversed(dates):
+        dt = utils.parsedate(date)
         if dt > last_update_date:
             log.debug("There is a record indicating bookmarks have been added after our last update")
-            _update_bookmarks_from_date(delicious, dt)
+            _update_bookmarks_from_date(delicious, dt, state)
+    
+    state.advance(success=True)
 
 #
 # Private API
 #
 
-def _update_bookmarks_from_date(delicious, dt):
+def _update_bookmarks_from_date(delicious, dt, state=None):
     log.debug("Reading bookmarks from %s", dt)
-    xml = delicious.posts.get(dt=dt.strftime("%Y-%m-%d"))
-    for post in xml.getiterator('post'):
+    items = []
+    for post in delicious.posts.get.iterate('post', dt=dt.strftime("%Y-%m-%d")):
         info = dict((k, smart_unicode(post.get(k))) for k in post.keys())
         if (info.has_key("shared") and settings.DELICIOUS_GETDNS) or (not info.has_key("shared")):
             log.debug("Handling bookmark for %r", info["href"])
-            _handle_bookmark(info)
+            items.append(_handle_bookmark(info))
         else:
             log.debug("Skipping bookmark for %r, app settings indicate to ignore bookmarks marked \"Do Not Share\"", info["href"])
+    Item.objects.bulk_create_or_update(items)
+    
+    # Record progress as part of the same transaction.
+    if state is not None and items:
+        state.advance(max(kwargs['timestamp'] for (bookmark, kwargs) in items))
 _update_bookmarks_from_date = transaction.commit_on_success(_update_bookmarks_from_date)
 
 def _handle_bookmark(info):
-    b, created = Bookmark.objects.get_or_create(
-        url = info['href'],
+    """
+    Save a bookmark. Returns the bookmark and the arguments for its Item.
+    """
+    b, written = upsert(Bookmark, 
+        lookup = dict(url=info['href']),
         defaults = dict(
             description = info['description'],
             extended = info.get('extended', ''),
-        )
+        ),
+        update = ['description', 'extended'],
     )
-    if not created:
-        b.description = info['description']
-        b.extended = info.get('extended', '')
-        b.save()
-    return Item.objects.create_or_update(
-        instance = b, 
+    return b, dict(
         timestamp = utils.parsedate(info['time']), 
         tags = info.get('tag', ''),
         source = __name__,
@@ -3,8 +3,10 @@ import logging
 import urllib
 from django.conf import settings
 from django.db import transaction
+from django.utils import simplejson
 from django.utils.encoding import smart_unicode
-from jellyroll.models import Item, Photo
+from jellyroll.managers import upsert
+from jellyroll.models import Item, Photo, SyncState
 from jellyroll.providers import utils
 
 log = logging.getLogger("jellyroll.providers.flickr")
@@ -36,6 +38,7 @@ class FlickrClient(object):
         params['format'] = 'json'
         params['nojsoncallback'] = '1'
         url = "http://flickr.com/services/rest/?" + urllib.urlencode(params)
+        utils.ratelimit("flickr")
         json = utils.getjson(url)
         if json.get("stat", "") == "fail":
             raise FlickrError(json["code"], json["message"])
@@ -61,9 +64,14 @@ def update():
     licenses = licenses = flickr.photos.licenses.getInfo()
     licenses = dict((l["id"], smart_unicode(l["url"])) for l in licenses["licenses"]["license"])
     
-    # Handle update by pages until we see photos we've already handled
-    last_update_date = Item.objects.get_last_update_of_model(Photo)
-    page = 1
+    # Handle update by pages until we see photos we've already handled. If
+    # the last run was interrupted part way through, pick up on the page it
+    # got to; the high-water mark isn't moved until a run finishes.
+    state = SyncState.objects.get_for_provider(__name__, Photo)
+    last_update_date = state.last_timestamp
+    cursor = state.cursor
+    page = cursor.get("page", 1)
+    newest = cursor.get("newest") and utils.parsedate(cursor["newest"]) or None
     while True:
         log.debug("Fetching page %s of photos", page)
         resp = flickr.people.getPublicPhotos(user_id=settings.FLICKR_USER_ID, extras="license,date_taken", per_page="500", page=str(page))
@@ -72,6 +80,7 @@ def update():
             log.debug("Ran out of photos; stopping.")
             break
             
+        new_photos = []
         for photodict in photos["photo"]:
             timestamp = utils.parsedate(str(photodict["datetaken"]))
             if timestamp < last_update_date:
@@ -81,16 +90,51 @@ def update():
             photo_id = utils.safeint(photodict["id"])
             license = licenses[photodict["license"]]
             secret = smart_unicode(photodict["secret"])
-            _handle_photo(flickr, photo_id, secret, license, timestamp)
+            new_photos.append((photo_id, secret, license, timestamp))
+        
+        # Fetch the details for the whole page at once. EXIF only gets
+        # fetched for photos we haven't seen before.
+        seen = set(Photo.objects.filter(photo_id__in=[str(p[0]) for p in new_photos]).values_list('photo_id', flat=True))
+        infos = utils.batch([(flickr.photos.getInfo, (), {'photo_id': photo_id, 'secret': secret}) 
+                             for (photo_id, secret, license, timestamp) in new_photos])
+        unseen = [(photo_id, secret) for (photo_id, secret, license, timestamp) in new_photos if str(photo_id) not in seen]
+        exifs = dict(zip([photo_id for (photo_id, secret) in unseen], 
+                         utils.batch([(flickr.photos.getExif, (), {'photo_id': photo_id, 'secret': secret}) 
+                                      for (photo_id, secret) in unseen])))
+        
+        for (photo_id, secret, license, timestamp) in new_photos:
+            if newest is None or timestamp > newest:
+                newest = timestamp
+        _handle_photos(flickr, new_photos, infos, exifs, 
+                       state = state, cursor = {"page": page, "newest": str(newest)})
             
         page += 1
+    
+    state.advance(newest, cursor={}, success=True)
         
 #
 # Private API
 #
 
-def _handle_photo(flickr, photo_id, secret, license, timestamp):
-    info = flickr.photos.getInfo(photo_id=photo_id, secret=secret)["photo"]
+def _handle_photos(flickr, photos, infos, exifs, state=None, cursor=None):
+    """
+    Save a page's worth of photos, and their Items, in one go.
+    """
+    items = []
+    for (photo_id, secret, license, timestamp), info in zip(photos, infos):
+        photo = _save_photo(photo_id, secret, license, timestamp, info=info, exif=exifs.get(photo_id))
+        items.append((photo, dict(
+            timestamp = timestamp,
+            tags = _convert_tags(info["photo"]["tags"]),
+            source = __name__,
+        )))
+    Item.objects.bulk_create_or_update(items)
+    if state is not None:
+        state.advance(cursor=cursor)
+_handle_photos = transaction.commit_on_success(_handle_photos)
+
+def _save_photo(photo_id, secret, license, timestamp, info, exif=None):
+    info = info["photo"]
     server_id = utils.safeint(info["server"])
     farm_id = utils.safeint(info["farm"])
     taken_by = smart_unicode(info["owner"]["username"])
@@ -101,43 +145,26 @@ def _handle_photo(flickr, photo_id, secret, license, timestamp):
     date_updated = datetime.datetime.fromtimestamp(utils.safeint(info["dates"]["lastupdate"]))
     
     log.debug("Handling photo: %r (taken %s)" % (title, timestamp))
-    photo, created = Photo.objects.get_or_create(
-        photo_id      = str(photo_id),
-        defaults = dict(
-            server_id     = server_id,
-            farm_id       = farm_id,
-            secret        = secret,
-            taken_by      = taken_by,
-            cc_license    = license,
-            title         = title,
-            description   = description,
-            comment_count = comment_count,
-            date_uploaded = date_uploaded,
-            date_updated  = date_updated,
-        )
+    fields = dict(
+        server_id     = server_id,
+        farm_id       = farm_id,
+        secret        = secret,
+        taken_by      = taken_by,
+        cc_license    = license,
+        title         = title,
+        description   = description,
+        comment_count = comment_count,
+        date_uploaded = date_uploaded,
+        date_updated  = date_updated,
     )
-    if created:
-        photo.exif = _convert_exif(flickr.photos.getExif(photo_id=photo_id, secret=secret))
-    else:
-        photo.server_id     = server_id
-        photo.farm_id       = farm_id
-        photo.secret        = secret
-        photo.taken_by      = taken_by
-        photo.cc_license    = license
-        photo.title         = title
-        photo.description   = description
-        photo.comment_count = comment_count
-        photo.date_uploaded = date_uploaded
-        photo.date_updated  = date_updated
-    photo.save()
+    update = fields.keys()
     
-    return Item.objects.create_or_update(
-        instance = photo, 
-        timestamp = timestamp,
-        tags = _convert_tags(info["tags"]),
-        source = __name__,
-    )
-_handle_photo = transaction.commit_on_success(_handle_photo)
+    # EXIF only gets fetched (by the caller) for new photos, so it's only
+    # written when it's given.
+    if exif is not None:
+        fields["_exif"] = simplejson.dumps(_convert_exif(exif))
+    photo, written = upsert(Photo, dict(photo_id=str(photo_id)), fields, update)
+    return photo
 
 def _convert_exif(exif):
     converted = {}
@@ -7,7 +7,7 @@ import tempfile
 from unipath import FSPath as Path
 from django.db import transaction
 from django.utils.encoding import smart_unicode
-from jellyroll.models import Item, CodeRepository, CodeCommit
+from jellyroll.models import Item, CodeRepository, CodeCommit, SyncState
 from jellyroll.providers import utils
 
 try:
@@ -38,7 +38,8 @@ def update():
 
 def _update_repository(repository):
     source_identifier = "%s:%s" % (__name__, repository.url)
-    last_update_date = Item.objects.get_last_update_of_model(CodeCommit, source=source_identifier)
+    state = SyncState.objects.get_for_provider(source_identifier, CodeCommit, source=source_identifier)
+    last_update_date = state.last_timestamp
     log.info("Updating changes from %s since %s", repository.url, last_update_date)
 
     # Git chokes on the 1969-12-31 sentinal returned by 
@@ -51,10 +52,11 @@ def _update_repository(repository):
     log.debug("Handling %s commits", len(commits))
     for commit in reversed(commits):
         if commit.author.email == repository.username:
-            _handle_revision(repository, commit)
+            _handle_revision(repository, commit, state)
             
     log.debug("Removing working dir %s.", working_dir)
     shutil.rmtree(working_dir)
+    state.advance(success=True)
 
 def _create_local_repo(repository):
     working_dir = tempfile.mkdtemp()
@@ -71,7 +73,7 @@ def _create_local_repo(repository):
     return working_dir, git.Repo(repo_location)
 
 @transaction.commit_on_success
-def _handle_revision(repository, commit):
+def _handle_revision(repository, commit, state=None):
     log.debug("Handling [%s] from %s", commit.id[:7], repository.url)
     ci, created = CodeCommit.objects.get_or_create(
         revision = commit.id,
@@ -84,8 +86,11 @@ def _handle_revision(repository, commit):
         if utils.JELLYROLL_ADJUST_DATETIME:
             return utils.utc_to_local_timestamp(time.mktime(commit.committed_date))
 
-        return Item.objects.create_or_update(
+        item = Item.objects.create_or_update(
             instance = ci, 
             timestamp = timestamp,
             source = "%s:%s" % (__name__, repository.url),
         )
+        if state is not None:
+            state.advance(timestamp, cursor={"revision": commit.id})
+        return item
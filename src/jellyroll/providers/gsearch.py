@@ -11,7 +11,7 @@ from jellyroll.models import Item, SearchEngine, WebSearch, WebSearchResult
 from jellyroll.models import VideoSource, Video
 from jellyroll.providers import utils
 
-RSS_URL = "https://%s:%s@www.google.com/searchhistory/?output=rss"
+RSS_URL = "https://www.google.com/searchhistory/?output=rss"
 VIDEO_TAG_URL = "http://video.google.com/tags?docid=%s"
 
 # Monkeypatch feedparser to understand smh:query_guid elements
@@ -32,7 +32,14 @@ def enabled():
     return ok
 
 def update():
-    feed = feedparser.parse(RSS_URL % (settings.GOOGLE_USERNAME, settings.GOOGLE_PASSWORD))
+    try:
+        body = utils.fetch_resource(RSS_URL, conditional=True,
+                                    username=settings.GOOGLE_USERNAME,
+                                    password=settings.GOOGLE_PASSWORD)
+    except utils.NotModified:
+        log.info("Skipping update: search history hasn't changed")
+        return
+    feed = feedparser.parse(body)
     for entry in feed.entries:
         if entry.tags[0].term == "web query":
             _handle_query(entry)
@@ -56,11 +63,7 @@ def _handle_query(entry):
     
     log.debug("Handling Google query for %r", query)
     try:
-        item = Item.objects.get(
-            content_type = CT(WebSearch),
-            source = __name__,
-            source_id = guid
-        )
+        item = Item.objects.for_source(__name__, guid).get(content_type=CT(WebSearch))
     except Item.DoesNotExist:
         item = Item.objects.create_or_update(
             instance = WebSearch(engine=engine, query=query), 
@@ -77,11 +80,7 @@ def _handle_result(entry):
 
     log.debug("Adding search result: %r" % url)
     try:
-        item = Item.objects.get(
-            content_type = CT(WebSearch),
-            source = __name__,
-            source_id = guid
-        )
+        item = Item.objects.for_source(__name__, guid).get(content_type=CT(WebSearch))
     except Item.DoesNotExist:
         log.debug("Skipping unknown query GUID: %r" % guid)
         return
@@ -7,8 +7,7 @@ from django.template.defaultfilters import slugify
 from django.utils.functional import memoize
 from django.utils.http import urlquote
 from django.utils.encoding import smart_str, smart_unicode
-from httplib2 import HttpLib2Error
-from jellyroll.models import Item, Track
+from jellyroll.models import Item, Track, SyncState
 from jellyroll.providers import utils
 
 #
@@ -33,11 +32,18 @@ def enabled():
     return ok
 
 def update():
-    last_update_date = Item.objects.get_last_update_of_model(Track)
-    log.debug("Last update date: %s", last_update_date)
+    state = SyncState.objects.get_for_provider(__name__, Track)
+    log.debug("Last update date: %s", state.last_timestamp)
     
-    xml = utils.getxml(RECENT_TRACKS_URL % settings.LASTFM_USERNAME)
-    for track in xml.getiterator("track"):
+    try:
+        stream = utils.iterxml(RECENT_TRACKS_URL % settings.LASTFM_USERNAME, "track", conditional=True)
+    except utils.NotModified:
+        log.info("Skipping update: no new tracks")
+        state.advance(success=True)
+        return
+    
+    tracks = []
+    for track in stream:
         artist      = track.find('artist')
         artist_name = smart_unicode(artist.text)
         artist_mbid = artist.get('mbid')
@@ -49,10 +55,26 @@ def update():
         timestamp = datetime.datetime.fromtimestamp(int(track.find('date').get('uts')))
         if utils.JELLYROLL_ADJUST_DATETIME:
             timestamp = utils.utc_to_local_timestamp(int(track.find('date').get('uts')))
-
-        if not _track_exists(artist_name, track_name, timestamp):
-            tags = _tags_for_track(artist_name, track_name)
-            _handle_track(artist_name, artist_mbid, track_name, track_mbid, url, timestamp, tags)
+        
+        tracks.append((artist_name, artist_mbid, track_name, track_mbid, url, timestamp))
+    
+    # Drop the tracks we've already got.
+    existing = Item.objects.existing_source_ids(__name__, [_source_id(t[0], t[2], t[5]) for t in tracks])
+    tracks = [t for t in tracks if _source_id(t[0], t[2], t[5]) not in existing]
+    
+    # The feed is newest first; handle the oldest first so that the sync
+    # state never gets ahead of what's actually been saved.
+    tracks.reverse()
+    
+    # Look up all the tags we don't already know about in one go.
+    urls = set()
+    for artist_name, artist_mbid, track_name, track_mbid, url, timestamp in tracks:
+        urls.update(_tag_urls(artist_name, track_name))
+    utils.batch([(_tags_for_url, (url,), {}) for url in urls if (url,) not in _tag_cache])
+    
+    _handle_tracks([track + (_tags_for_track(track[0], track[2]),) for track in tracks], state)
+    
+    state.advance(success=True)
 
 #
 # Private API
@@ -64,26 +86,31 @@ def _tags_for_track(artist_name, track_name):
     includes tracks that break a certain threshold of usage, defined by
     settings.LASTFM_TAG_USAGE_THRESHOLD (which defaults to 15).
     """
-    
-    urls = [
+    tags = set()
+    for url in _tag_urls(artist_name, track_name):
+        tags.update(_tags_for_url(url))
+    return " ".join(sorted(tags))
+
+def _tag_urls(artist_name, track_name):
+    return [
         ARTIST_TAGS_URL % (urlquote(artist_name)),
         TRACK_TAGS_URL % (urlquote(artist_name), urlquote(track_name)),
     ]
-    tags = set()
-    for url in urls:
-        tags.update(_tags_for_url(url))
         
 def _tags_for_url(url):
-    tags = set()
+    """
+    Get the tags for a tag URL, or none at all if they can't be fetched
+    right now. Tags are nice to have; don't give up on a track without them.
+    """
     try:
-        xml = utils.getxml(url)
-    except HttpLib2Error, e:
-        if e.code == 408:
-            return ""
-        else:
-            raise
-    except SyntaxError:
-        return ""
+        return _fetch_tags(url)
+    except (utils.HttpError, SyntaxError):
+        return set()
+        
+def _fetch_tags(url):
+    tags = set()
+    utils.ratelimit("lastfm")
+    xml = utils.getxml(url)
     for t in xml.getiterator("tag"):
         count = utils.safeint(t.find("count").text)
         if count >= getattr(settings, 'LASTFM_TAG_USAGE_THRESHOLD', 15):
@@ -92,38 +119,37 @@ def _tags_for_url(url):
     
     return tags
             
-# Memoize tags to avoid unnecessary API calls.
+# Memoize tags to avoid unnecessary API calls. Failures raise, so they
+# aren't memoized, and get another try the next time the URL comes up.
 _tag_cache = {}
-_tags_for_url = memoize(_tags_for_url, _tag_cache, 1)
+_fetch_tags = memoize(_fetch_tags, _tag_cache, 1)
 
 @transaction.commit_on_success
-def _handle_track(artist_name, artist_mbid, track_name, track_mbid, url, timestamp, tags):
-    t = Track(
-        artist_name = artist_name,
-        track_name  = track_name,
-        url         = url,
-        track_mbid  = track_mbid is not None and track_mbid or '',
-        artist_mbid = artist_mbid is not None and artist_mbid or '',
-    )
-    if not _track_exists(artist_name, track_name, timestamp):
+def _handle_tracks(tracks, state=None):
+    items = []
+    seen = set()
+    for artist_name, artist_mbid, track_name, track_mbid, url, timestamp, tags in tracks:
+        source_id = _source_id(artist_name, track_name, timestamp)
+        if source_id in seen:
+            continue
+        seen.add(source_id)
         log.debug("Saving track: %r - %r", artist_name, track_name)
-        return Item.objects.create_or_update(
-            instance = t,
+        t = Track(
+            artist_name = artist_name,
+            track_name  = track_name,
+            url         = url,
+            track_mbid  = track_mbid is not None and track_mbid or '',
+            artist_mbid = artist_mbid is not None and artist_mbid or '',
+        )
+        items.append((t, dict(
             timestamp = timestamp,
             tags = tags,
             source = __name__,
-            source_id = _source_id(artist_name, track_name, timestamp),
-        )
+            source_id = source_id,
+        )))
+    Item.objects.bulk_create_or_update(items)
+    if state is not None and items:
+        state.advance(max(kwargs['timestamp'] for (track, kwargs) in items))
         
 def _source_id(artist_name, track_name, timestamp):
     return hashlib.md5(smart_str(artist_name) + smart_str(track_name) + str(timestamp)).hexdigest()
-    
-def _track_exists(artist_name, track_name, timestamp):
-    id = _source_id(artist_name, track_name, timestamp)
-    try:
-        Item.objects.get(source=__name__, source_id=id)
-    except Item.DoesNotExist:
-        return False
-    else:
-        return True
-
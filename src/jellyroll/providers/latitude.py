@@ -9,7 +9,7 @@ import datetime
 import logging
 from django.conf import settings
 from django.db import transaction
-from jellyroll.models import Location, Item
+from jellyroll.models import Location, Item, SyncState
 from jellyroll.providers import utils
 
 log = logging.getLogger("jellyroll.providers.latitude")
@@ -25,28 +25,32 @@ def enabled():
     return ok
 
 def update():
-    last_update_date = Item.objects.get_last_update_of_model(Location)
-    log.debug("Last update date: %s", last_update_date)
-    _update_location(settings.GOOGLE_LATITUDE_USER_ID, since=last_update_date)
+    state = SyncState.objects.get_for_provider(__name__, Location)
+    log.debug("Last update date: %s", state.last_timestamp)
+    _update_location(settings.GOOGLE_LATITUDE_USER_ID, state)
         
 #
 # Private API
 #
 
 @transaction.commit_on_success
-def _update_location(user_id, since):
+def _update_location(user_id, state):
     json = utils.getjson('http://www.google.com/latitude/apps/badge/api?user=%s&type=json' % user_id)
     feature = json['features'][0]
     
     lat, lng = map(str, feature['geometry']['coordinates'])
     name = feature['properties']['reverseGeocode']
     timestamp = datetime.datetime.fromtimestamp(feature['properties']['timeStamp'])
-    if timestamp > since:
+    if timestamp > state.last_timestamp:
         log.debug("New location: %s", name)
         loc = Location(latitude=lat, longitude=lng, name=name)
-        return Item.objects.create_or_update(
+        item = Item.objects.create_or_update(
             instance = loc,
             timestamp = timestamp,
             source = __name__,
             source_id = str(feature['properties']['timeStamp']),
-        )
\ No newline at end of file
+        )
+    else:
+        item = None
+    state.advance(timestamp, success=True)
+    return item
\ No newline at end of file
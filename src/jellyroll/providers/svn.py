@@ -3,7 +3,7 @@ import logging
 import datetime
 from django.db import transaction
 from django.utils.encoding import smart_unicode
-from jellyroll.models import Item, CodeRepository, CodeCommit
+from jellyroll.models import Item, CodeRepository, CodeCommit, SyncState
 from jellyroll.providers import utils
 
 
@@ -34,15 +34,20 @@ def update():
 
 def _update_repository(repository):
     source_identifier = "%s:%s" % (__name__, repository.url)
-    last_update_date = Item.objects.get_last_update_of_model(CodeCommit, source=source_identifier)
-    log.info("Updating changes from %s since %s", repository.url, last_update_date)
+    state = SyncState.objects.get_for_provider(source_identifier, CodeCommit, source=source_identifier)
+    last_update_date = state.last_timestamp
+    last_revision = state.cursor.get("revision", 0)
+    log.info("Updating changes from %s since %s (r%s)", repository.url, last_update_date, last_revision)
     rev = pysvn.Revision(pysvn.opt_revision_kind.date, time.mktime(last_update_date.timetuple()))
     c = pysvn.Client()
     for revision in reversed(c.log(repository.url, revision_end=rev)):
+        if revision.revision.number <= last_revision:
+            continue
         if revision.author == repository.username:
-            _handle_revision(repository, revision)
+            _handle_revision(repository, revision, state)
+    state.advance(success=True)
 
-def _handle_revision(repository, r):
+def _handle_revision(repository, r, state=None):
     log.debug("Handling [%s] from %s" % (r.revision.number, repository.url))
     ci, created = CodeCommit.objects.get_or_create(
         revision = str(r.revision.number),
@@ -50,9 +55,13 @@ def _handle_revision(repository, r):
         defaults = {"message": smart_unicode(r.message)}
     )
     if created:
-        return Item.objects.create_or_update(
+        timestamp = datetime.datetime.fromtimestamp(r.date)
+        item = Item.objects.create_or_update(
             instance = ci, 
-            timestamp = datetime.datetime.fromtimestamp(r.date),
+            timestamp = timestamp,
             source = "%s:%s" % (__name__, repository.url),
         )
+        if state is not None:
+            state.advance(timestamp, cursor={"revision": r.revision.number})
+        return item
 _handle_revision = transaction.commit_on_success(_handle_revision)
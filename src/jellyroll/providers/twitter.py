@@ -1,7 +1,6 @@
 import hashlib
 import datetime
 import logging
-import dateutil
 import re
 from django.conf import settings
 from django.db import transaction
@@ -11,7 +10,8 @@ from django.utils.http import urlquote
 from django.utils.encoding import smart_str, smart_unicode
 from httplib2 import HttpLib2Error
 from jellyroll.providers import utils
-from jellyroll.models import Item, Message, ContentLink
+from jellyroll.providers.utils import dates
+from jellyroll.models import Item, Message, ContentLink, SyncState
 
 
 #
@@ -31,22 +31,46 @@ def enabled():
     return True
 
 def update():
-    last_update_date = Item.objects.get_last_update_of_model(Message)
-    log.debug("Last update date: %s", last_update_date)
+    state = SyncState.objects.get_for_provider(__name__, Message)
+    log.debug("Last update date: %s", state.last_timestamp)
     
-    xml = utils.getxml(RECENT_STATUSES_URL % settings.TWITTER_USERNAME)
-    for status in xml.getiterator("item"):
+    # Only ask for statuses newer than the last one we saw, if we know it.
+    feed_url = RECENT_STATUSES_URL % settings.TWITTER_USERNAME
+    since_id = state.cursor.get("since_id")
+    if since_id:
+        feed_url += "?since_id=%s" % since_id
+    
+    try:
+        stream = utils.iterxml(feed_url, "item", conditional=True)
+    except utils.NotModified:
+        log.info("Skipping update: no new statuses")
+        state.advance(success=True)
+        return
+    
+    statuses = []
+    for status in stream:
         message      = status.find('title')
         message_text = smart_unicode(message.text)
         url          = smart_unicode(status.find('link').text)
 
         # pubDate delivered as UTC
-        timestamp    = dateutil.parser.parse(status.find('pubDate').text)
+        timestamp    = dates.parse(status.find('pubDate').text)
         if utils.JELLYROLL_ADJUST_DATETIME:
             timestamp = utils.utc_to_local_datetime(timestamp)
-
-        if not _status_exists(message_text, url, timestamp):
-            _handle_status(message_text, url, timestamp)
+        
+        # Items are keyed on the message as it's saved, i.e. transformed.
+        message_text, links, tags = _parse_message(message_text)
+        source_id = _source_id(message_text, url, timestamp)
+        statuses.append((source_id, message_text, links, tags, url, timestamp))
+    
+    # Statuses arrive newest first; save the oldest first so that since_id
+    # only ever points at statuses that have actually been saved.
+    existing = Item.objects.existing_source_ids(__name__, [status[0] for status in statuses])
+    for source_id, message_text, links, tags, url, timestamp in reversed(statuses):
+        if source_id not in existing:
+            _handle_status(source_id, message_text, links, tags, url, timestamp, state)
+    
+    state.advance(success=True)
 
 #
 # GLOBAL CLUTTER
@@ -131,41 +155,45 @@ else:
 #
 
 @transaction.commit_on_success
-def _handle_status(message_text, url, timestamp):
-    message_text, links, tags = _parse_message(message_text)
-
+def _handle_status(source_id, message_text, links, tags, url, timestamp, state=None):
     t = Message(
         message = message_text,
         )
 
-    if not _status_exists(message_text, url, timestamp):
-        log.debug("Saving message: %r", message_text)
-        item = Item.objects.create_or_update(
-            instance = t,
-            timestamp = timestamp,
-            source = __name__,
-            source_id = _source_id(message_text, url, timestamp),
-            url = url,
-            tags = tags,
-            )
-        item.save()
+    # update() has already skipped statuses we've seen.
+    log.debug("Saving message: %r", message_text)
+    item = Item.objects.create_or_update(
+        instance = t,
+        timestamp = timestamp,
+        source = __name__,
+        source_id = source_id,
+        url = url,
+        tags = tags,
+        )
 
-        for link in links:
-            l = ContentLink(
-                url = link,
-                identifier = link,
-                )
-            l.save()
-            t.links.add(l)
+    for link in links:
+        l = ContentLink(
+            url = link,
+            identifier = link,
+            )
+        l.save()
+        t.links.add(l)
+    
+    if state is not None:
+        status_id = _status_id(url)
+        if status_id:
+            state.advance(timestamp, cursor={"since_id": status_id})
+        else:
+            state.advance(timestamp)
 
 def _source_id(message_text, url, timestamp):
     return hashlib.md5(smart_str(message_text) + smart_str(url) + str(timestamp)).hexdigest()
     
-def _status_exists(message_text, url, timestamp):
-    id = _source_id(message_text, url, timestamp)
-    try:
-        Item.objects.get(source=__name__, source_id=id)
-    except Item.DoesNotExist:
-        return False
-    else:
-        return True
+def _status_id(url):
+    """
+    Pull the numeric status id off the end of a status URL.
+    """
+    status_id = url.rstrip('/').rsplit('/', 1)[-1]
+    if status_id.isdigit():
+        return status_id
+    return None
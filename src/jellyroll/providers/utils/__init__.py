@@ -1,15 +1,56 @@
-import httplib2
-import dateutil.parser
-import dateutil.tz
+import os
+import time
+import threading
+import cStringIO
 from django.utils import simplejson
 from django.utils.encoding import force_unicode
 from django.conf import settings
 from jellyroll.providers.utils.anyetree import etree
+from jellyroll.providers.utils.pool import HttpPool
+from jellyroll.providers.utils.httpcache import ResponseCache
+from jellyroll.providers.utils.batch import batch as _batch
+from jellyroll.providers.utils.ratelimit import TokenBucket
+from jellyroll.providers.utils.dates import parsedate
+from jellyroll.providers.utils.policy import FetchPolicy, HttpError, CircuitOpen, DeadlineExceeded
 
 DEFAULT_HTTP_HEADERS = {
-    "User-Agent" : "Jellyroll/1.0 (http://github.com/jacobian/jellyroll/tree/master)"
+    "User-Agent" : "Jellyroll/1.0 (http://github.com/jacobian/jellyroll/tree/master)",
+    "Accept-Encoding" : "gzip, deflate",
 }
 
+# Shared keep-alive clients used by fetch_resource.
+http_pool = HttpPool(
+    size = getattr(settings, "JELLYROLL_HTTP_POOL_SIZE", 4),
+    timeout = getattr(settings, "JELLYROLL_HTTP_TIMEOUT", 15),
+)
+
+# Retries and circuit breakers for fetch_resource.
+fetch_policy = FetchPolicy(
+    retries = getattr(settings, "JELLYROLL_HTTP_RETRIES", 2),
+    backoff = getattr(settings, "JELLYROLL_HTTP_BACKOFF", 0.5),
+    threshold = getattr(settings, "JELLYROLL_CIRCUIT_THRESHOLD", 5),
+    cooldown = getattr(settings, "JELLYROLL_CIRCUIT_COOLDOWN", 60),
+)
+
+# Validators for conditional GETs; only used if a cache directory is set.
+if getattr(settings, "JELLYROLL_HTTP_CACHE_DIR", None):
+    response_cache = ResponseCache(
+        settings.JELLYROLL_HTTP_CACHE_DIR,
+        max_size = getattr(settings, "JELLYROLL_HTTP_CACHE_SIZE", 10*1024*1024),
+    )
+else:
+    response_cache = None
+
+class NotModified(Exception):
+    """
+    Raised by a conditional fetch when the resource hasn't changed since it
+    was last fetched. The cached body is available as ``content``.
+    """
+    def __init__(self, url, content):
+        self.url, self.content = url, content
+    def __str__(self):
+        return 'Not modified: %s' % self.url
+
 #
 # URL fetching sugar
 #
@@ -19,36 +60,180 @@ def getxml(url, **kwargs):
     xml = fetch_resource(url, **kwargs)
     return etree.fromstring(xml)
     
+def batch(calls, workers=None):
+    """
+    Run a list of ``(callable, args, kwargs)`` calls concurrently, returning
+    their results in order. See ``jellyroll.providers.utils.batch``.
+    
+    The calls are part of this thread's provider run (see ``start_run``):
+    they're held to its deadline, and the validators they store are
+    forgotten along with the rest if the run fails.
+    """
+    if workers is None:
+        workers = getattr(settings, "JELLYROLL_HTTP_WORKERS", 4)
+    deadline = getattr(_run, 'deadline', None)
+    fetched = getattr(_run, 'fetched', None)
+    def in_run(func, args, kwargs):
+        _run.deadline, _run.fetched = deadline, fetched
+        return func(*args, **kwargs)
+    return _batch([(in_run, tuple(call), {}) for call in calls], workers)
+
+def fetch_many(urls, **kwargs):
+    """
+    Fetch a bunch of URLs concurrently; returns the bodies in order.
+    """
+    return batch([(fetch_resource, (url,), kwargs) for url in urls])
+
+def iterxml(url, tag, **kwargs):
+    """
+    Fetch some XML and parse it incrementally, yielding each ``tag`` element
+    (or each element whose tag is in ``tag``, if it's a list) as soon as
+    it's been parsed. Each element is cleared once the caller moves on to
+    the next one, so pull out what you need before then.
+    
+    The fetch happens right away, so fetch errors (including
+    ``NotModified``) are raised by this call rather than by the iteration.
+    """
+    xml = fetch_resource(url, **kwargs)
+    return iterparse(cStringIO.StringIO(xml), tag)
+
+def iterparse(source, tag):
+    """
+    Incrementally parse XML from a file-like object; see ``iterxml``.
+    """
+    if isinstance(tag, basestring):
+        tags = (tag,)
+    else:
+        tags = tuple(tag)
+    for event, elem in etree.iterparse(source, events=("end",)):
+        if elem.tag in tags:
+            yield elem
+            elem.clear()
+            # lxml can also let go of the emptied-out elements we've passed.
+            if hasattr(elem, 'getprevious'):
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+    
 def getjson(url, **kwargs):
     """Fetch and parse some JSON. Returns the deserialized JSON."""
     json = fetch_resource(url, **kwargs)
     return simplejson.loads(json)
 
-def fetch_resource(url, method="GET", body=None, username=None, password=None, headers=None):
-    h = httplib2.Http(timeout=15)
-    h.force_exception_to_status_code = True
+def fetch_resource(url, method="GET", body=None, username=None, password=None, headers=None, conditional=False):
+    """
+    Fetch a URL using the shared connection pool. Returns the (decompressed)
+    response body.
     
-    if username is not None or password is not None:
-        h.add_credentials(username, password)
+    Failed requests are retried according to ``fetch_policy``; if the
+    request still fails ``HttpError`` is raised (``CircuitOpen`` if the host
+    has been failing so often that it wasn't even tried). If the provider
+    run has gone past JELLYROLL_PROVIDER_DEADLINE, ``DeadlineExceeded`` is
+    raised instead.
     
+    If ``conditional`` is true (and JELLYROLL_HTTP_CACHE_DIR is set) the
+    request is sent with the validators from the last time the URL was
+    fetched, and ``NotModified`` is raised if the server says nothing has
+    changed.
+    """
     if headers is None:
         headers = DEFAULT_HTTP_HEADERS.copy()
     
-    response, content = h.request(url, method, body, headers)
+    cache_key = None
+    if conditional and response_cache is not None and method == "GET":
+        cache_key = response_cache.key(url, username)
+        headers = dict(headers, **response_cache.conditional_headers(cache_key))
+    
+    def request():
+        return http_pool.request(url, method, body, headers,
+                                 username=username, password=password)
+    response, content = fetch_policy.call(url, request, deadline=getattr(_run, 'deadline', None))
+    
+    if cache_key is not None:
+        if response.status == 304:
+            entry = response_cache.get(cache_key)
+            raise NotModified(url, entry and entry['content'] or None)
+        if response.status == 200:
+            response_cache.set(cache_key, response, content)
+            _record_fetch(cache_key)
     return content
+
+#
+# Rate limiting
+#
+
+# Default (calls per second, burst) limits for each API. Override or add to
+# these with the JELLYROLL_RATE_LIMITS setting.
+DEFAULT_RATE_LIMITS = {
+    # Yahoo asks for no more than one call a second; leave some slack.
+    "delicious" : (0.5, 1),
+    # 3600 calls an hour.
+    "flickr"    : (1, 5),
+    "lastfm"    : (5, 5),
+}
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def ratelimit(name):
+    """
+    Wait until the named API's rate limit allows another call.
     
+    Buckets are shared by every thread in the process. If
+    JELLYROLL_RATE_LIMIT_DIR is set they're kept in lock files in that
+    directory, and so shared by every process as well.
+    """
+    _buckets_lock.acquire()
+    try:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            limits = dict(DEFAULT_RATE_LIMITS, **getattr(settings, "JELLYROLL_RATE_LIMITS", {}))
+            if name not in limits:
+                return
+            rate, burst = limits[name]
+            lockdir = getattr(settings, "JELLYROLL_RATE_LIMIT_DIR", None)
+            lockfile = lockdir and os.path.join(lockdir, "%s.bucket" % name) or None
+            bucket = _buckets[name] = TokenBucket(rate, burst, lockfile=lockfile)
+    finally:
+        _buckets_lock.release()
+    bucket.acquire()
+
 #
-# Date handling utils
+# Provider run bookkeeping
 #
 
-def parsedate(s):
+_run = threading.local()
+
+def start_run():
+    """
+    Note the start of a provider run in this thread. If
+    JELLYROLL_PROVIDER_DEADLINE is set, fetches made more than that many
+    seconds into the run fail with ``DeadlineExceeded``.
+    """
+    _run.fetched = []
+    timeout = getattr(settings, "JELLYROLL_PROVIDER_DEADLINE", None)
+    _run.deadline = timeout and time.time() + timeout or None
+
+def finish_run(success=True):
     """
-    Convert a string into a (local, naive) datetime object.
+    Note the end of a provider run in this thread. If the run failed, forget
+    the validators it stored so that the next run refetches those resources
+    instead of being told they haven't changed.
     """
-    dt = dateutil.parser.parse(s)
-    if dt.tzinfo:
-        dt = dt.astimezone(dateutil.tz.tzlocal()).replace(tzinfo=None)
-    return dt
+    fetched = getattr(_run, 'fetched', None) or []
+    _run.fetched = None
+    _run.deadline = None
+    if not success and response_cache is not None:
+        for key in fetched:
+            response_cache.discard(key)
+
+def _record_fetch(cache_key):
+    fetched = getattr(_run, 'fetched', None)
+    if fetched is not None:
+        fetched.append(cache_key)
+    
+#
+# Date handling utils
+#
 
 def safeint(s):
     """Always returns an int. Returns 0 on failure."""
@@ -0,0 +1,61 @@
+"""
+Run a batch of calls -- usually API requests -- side by side. Usage::
+
+    >>> results = batch([
+    ...     (flickr.photos.getInfo, (), {'photo_id': 1}),
+    ...     (flickr.photos.getInfo, (), {'photo_id': 2}),
+    ... ])
+
+Results come back in the same order as the calls. Requests made through
+``fetch_resource`` are still capped per host by the connection pool, so a
+big batch against one API won't open more than the pool allows.
+"""
+
+import sys
+import threading
+import Queue
+
+__all__ = ['batch']
+
+def batch(calls, workers=4):
+    """
+    Run each ``(callable, args, kwargs)`` in ``calls`` using up to
+    ``workers`` threads, and return a list of the results. If any call
+    raises an exception, the first one (in call order) is re-raised once
+    the whole batch has finished.
+    """
+    calls = list(calls)
+    if not calls:
+        return []
+    if workers <= 1 or len(calls) == 1:
+        return [func(*args, **kwargs) for (func, args, kwargs) in calls]
+
+    results = [None] * len(calls)
+    errors = [None] * len(calls)
+    queue = Queue.Queue()
+    for i, call in enumerate(calls):
+        queue.put((i, call))
+
+    def worker():
+        while True:
+            try:
+                i, (func, args, kwargs) = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results[i] = func(*args, **kwargs)
+            except Exception:
+                errors[i] = sys.exc_info()
+
+    threads = [threading.Thread(target=worker) for i in range(min(workers, len(calls)))]
+    for t in threads:
+        t.setDaemon(True)
+        t.start()
+    for t in threads:
+        while t.isAlive():
+            t.join(1)
+
+    for exc_info in errors:
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+    return results
@@ -0,0 +1,153 @@
+"""
+Date parsing for the formats provider APIs actually use.
+
+``dateutil.parser.parse`` will take almost anything, but it's slow -- and
+in an ingest loop most of the time goes on the handful of formats below.
+Those are matched with precompiled regexes; anything else falls back to
+dateutil. Usage::
+
+    >>> parse("2009-08-18T15:30:16Z")
+    datetime.datetime(2009, 8, 18, 15, 30, 16, tzinfo=tzutc())
+    >>> parsedate("Tue, 18 Aug 2009 15:30:16 +0000")    # local, naive
+    datetime.datetime(2009, 8, 18, 10, 30, 16)
+
+Handled directly:
+
+    * ISO 8601 dates and times (delicious, Google), including Flickr's
+      ``datetaken`` format ("2009-07-21 11:45:06").
+    * RFC 822 dates with a numeric or UTC zone (Twitter and other RSS feeds).
+
+Results are memoized, since feeds tend to repeat the same timestamps (every
+bookmark posted on a day, say).
+"""
+
+import re
+import datetime
+import threading
+import email.utils
+import dateutil.parser
+import dateutil.tz
+
+__all__ = ['parse', 'parsedate']
+
+ISO_RE = re.compile(r"""
+    ^(\d{4})-(\d{2})-(\d{2})                # date
+    (?:[T\ ](\d{2}):(\d{2})                 # time
+       (?::(\d{2})(?:[.,](\d{1,6})\d*)?)?   # seconds, fractions
+       \s*(Z|[+-]\d{2}(?::?\d{2})?)?        # zone
+    )?$
+""", re.VERBOSE)
+
+RFC822_RE = re.compile(r"""
+    ^(?:[A-Za-z]{3},\s*)?
+    \d{1,2}\s+[A-Za-z]{3}\s+\d{2,4}\s+
+    \d{1,2}:\d{2}(?::\d{2})?\s+
+    (?:[+-]\d{4}|GMT|UTC?|Z)$
+""", re.VERBOSE)
+
+# Bound on the number of memoized strings; the memo is simply emptied when
+# it fills up.
+MEMO_SIZE = 1000
+
+_memo = {}
+_tzcache = {}
+_tzlock = threading.Lock()
+
+def parse(s):
+    """
+    Parse a date string, returning a ``datetime`` just like
+    ``dateutil.parser.parse`` would: timezone-aware if the string has an
+    offset, naive if it doesn't.
+    """
+    return _memoized(s, False)
+
+def parsedate(s):
+    """
+    Parse a date string into a (local, naive) datetime object.
+    """
+    return _memoized(s, True)
+
+def to_local(dt):
+    """
+    Convert a timezone-aware datetime into a (local, naive) one, like the
+    ones ``parsedate`` returns. Naive datetimes are returned as they are.
+    """
+    if dt.tzinfo:
+        dt = dt.astimezone(_tz('local')).replace(tzinfo=None)
+    return dt
+
+def _memoized(s, local):
+    key = (s, local)
+    try:
+        return _memo[key]
+    except KeyError:
+        pass
+    dt = _parse(s)
+    if local:
+        dt = to_local(dt)
+    if len(_memo) >= MEMO_SIZE:
+        _memo.clear()
+    _memo[key] = dt
+    return dt
+
+def _parse(s):
+    s = s.strip()
+    m = ISO_RE.match(s)
+    if m:
+        year, month, day, hour, minute, second, fraction, zone = m.groups()
+        microsecond = fraction and int(fraction.ljust(6, '0')) or 0
+        return datetime.datetime(int(year), int(month), int(day),
+                                 int(hour or 0), int(minute or 0), int(second or 0),
+                                 microsecond, _zone(zone))
+
+    if RFC822_RE.match(s):
+        parsed = email.utils.parsedate_tz(s)
+        if parsed and parsed[9] is not None:
+            year = parsed[0]
+            if year < 100:
+                year += year < 50 and 2000 or 1900
+            return datetime.datetime(year, parsed[1], parsed[2], parsed[3], parsed[4], parsed[5],
+                                     0, _offset(parsed[9]))
+
+    return dateutil.parser.parse(s)
+
+def _zone(zone):
+    if zone is None:
+        return None
+    if zone == 'Z':
+        return _offset(0)
+    zone = zone.replace(':', '')
+    sign = zone[0] == '-' and -1 or 1
+    hours, minutes = int(zone[1:3]), int(zone[3:5] or 0)
+    return _offset(sign * (hours * 3600 + minutes * 60))
+
+def _offset(seconds):
+    """
+    Return a tzinfo for a UTC offset, the same way dateutil does.
+    """
+    if seconds == 0:
+        return _tz('utc')
+    return _tz(seconds)
+
+def _tz(key):
+    """
+    Return a cached tzinfo object: 'utc', 'local', or a fixed offset in
+    seconds. The local zone is only looked up on first use, after Django
+    has had a chance to set TZ.
+    """
+    try:
+        return _tzcache[key]
+    except KeyError:
+        pass
+    _tzlock.acquire()
+    try:
+        if key not in _tzcache:
+            if key == 'utc':
+                _tzcache[key] = dateutil.tz.tzutc()
+            elif key == 'local':
+                _tzcache[key] = dateutil.tz.tzlocal()
+            else:
+                _tzcache[key] = dateutil.tz.tzoffset(None, key)
+        return _tzcache[key]
+    finally:
+        _tzlock.release()
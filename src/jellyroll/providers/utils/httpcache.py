@@ -0,0 +1,142 @@
+"""
+A disk-backed cache of HTTP validators and bodies, for conditional GETs.
+
+Each cached response lives in its own file under the cache directory, keyed
+by a hash of the URL (and the username, for authenticated requests). Only
+responses that carry an ``ETag`` or ``Last-Modified`` header are worth
+keeping. Usage::
+
+    >>> cache = ResponseCache("/var/cache/jellyroll", max_size=10*1024*1024)
+    >>> key = cache.key(url)
+    >>> cache.conditional_headers(key)
+    {'if-none-match': '"abc123"'}
+
+Once the total size of the cache goes over ``max_size`` bytes the least
+recently used entries are thrown away.
+"""
+
+import os
+import hashlib
+import tempfile
+import cPickle as pickle
+from django.utils.encoding import smart_str
+
+__all__ = ['ResponseCache']
+
+class ResponseCache(object):
+
+    def __init__(self, directory, max_size=10*1024*1024):
+        self.directory = directory
+        self.max_size = max_size
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, url, username=None):
+        """
+        Return the cache key for a URL, as fetched by a given user.
+        """
+        return hashlib.md5("%s\n%s" % (smart_str(url), smart_str(username or ''))).hexdigest()
+
+    def get(self, key):
+        """
+        Return the cached entry (a dict with ``etag``, ``last_modified`` and
+        ``content`` keys) for a key, or ``None``.
+        """
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+            try:
+                entry = pickle.load(f)
+            finally:
+                f.close()
+        except (IOError, EOFError, pickle.UnpicklingError):
+            return None
+        # Touch the file so eviction treats it as recently used.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry
+
+    def set(self, key, response, content):
+        """
+        Store a response's validators and body. Responses without validators
+        aren't stored (and any stale entry for the key is dropped).
+        """
+        etag = response.get('etag')
+        last_modified = response.get('last-modified')
+        if not etag and not last_modified:
+            self.discard(key)
+            return
+        entry = {
+            'etag': etag,
+            'last_modified': last_modified,
+            'content': content,
+        }
+
+        # Write to a temp file and rename it into place so that concurrent
+        # readers never see a half-written entry.
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                pickle.dump(entry, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmp, self._path(key))
+        except (IOError, OSError):
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def discard(self, key):
+        """
+        Forget a cached entry.
+        """
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def conditional_headers(self, key):
+        """
+        Return the ``If-None-Match``/``If-Modified-Since`` headers to send for
+        a key. Empty if there's nothing cached.
+        """
+        entry = self.get(key)
+        headers = {}
+        if entry:
+            if entry['etag']:
+                headers['if-none-match'] = entry['etag']
+            if entry['last_modified']:
+                headers['if-modified-since'] = entry['last_modified']
+        return headers
+
+    def _path(self, key):
+        return os.path.join(self.directory, "%s.cache" % key)
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith('.cache'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        entries.sort()
+        while total > self.max_size and entries:
+            mtime, size, path = entries.pop(0)
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
@@ -0,0 +1,163 @@
+"""
+What to do when a fetch goes wrong: status checking, retries with
+exponential backoff, and a circuit breaker per host. Usage::
+
+    >>> policy = FetchPolicy(retries=2, backoff=0.5)
+    >>> response, content = policy.call(url, lambda: http.request(url))
+
+Connection errors, timeouts and 5xx responses are retried; other 4xx
+responses fail straight away. Once a host has failed ``threshold`` times in
+a row its circuit opens, and requests to it fail immediately (with
+``CircuitOpen``) for ``cooldown`` seconds. After that a single request is let
+through to see if the host has come back.
+"""
+
+import time
+import socket
+import httplib
+import threading
+import urlparse
+import httplib2
+
+__all__ = ['FetchPolicy', 'CircuitBreaker', 'HttpError', 'CircuitOpen', 'DeadlineExceeded']
+
+# Statuses worth trying again.
+RETRY_STATUSES = (408, 500, 502, 503, 504)
+
+# Exceptions that mean we never got a response at all.
+CONNECTION_ERRORS = (socket.error, httplib.HTTPException, httplib2.HttpLib2Error)
+
+class HttpError(httplib2.HttpLib2Error):
+    """
+    A fetch failed. ``code`` is the HTTP status, or ``None`` if there was no
+    response at all.
+    """
+    def __init__(self, url, code=None, reason=None):
+        self.url, self.code, self.reason = url, code, reason
+    def __str__(self):
+        if self.code:
+            return 'HTTP %s fetching %s' % (self.code, self.url)
+        return 'Error fetching %s: %s' % (self.url, self.reason)
+
+class CircuitOpen(HttpError):
+    """
+    The host has been failing, so we didn't even try.
+    """
+    def __str__(self):
+        return 'Not fetching %s: too many recent failures' % self.url
+
+class DeadlineExceeded(Exception):
+    """
+    The provider run has used up its time.
+    """
+
+class CircuitBreaker(object):
+
+    def __init__(self, threshold=5, cooldown=60, clock=time.time):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Should a request be let through?
+        """
+        self._lock.acquire()
+        try:
+            if self.opened_at is None:
+                return True
+            if self._clock() - self.opened_at >= self.cooldown:
+                # Let one request through to test the water; everyone else
+                # waits out another cooldown unless it succeeds.
+                self.opened_at = self._clock()
+                return True
+            return False
+        finally:
+            self._lock.release()
+
+    def success(self):
+        self._lock.acquire()
+        try:
+            self.failures = 0
+            self.opened_at = None
+        finally:
+            self._lock.release()
+
+    def failure(self):
+        self._lock.acquire()
+        try:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = self._clock()
+        finally:
+            self._lock.release()
+
+class FetchPolicy(object):
+
+    def __init__(self, retries=2, backoff=0.5, threshold=5, cooldown=60, clock=time.time, sleep=time.sleep):
+        self.retries = retries
+        self.backoff = backoff
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._clock = clock
+        self._sleep = sleep
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def breaker(self, url):
+        """
+        Return the circuit breaker for the host ``url`` lives on.
+        """
+        host = urlparse.urlsplit(url)[1]
+        self._lock.acquire()
+        try:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(self.threshold, self.cooldown, self._clock)
+            return breaker
+        finally:
+            self._lock.release()
+
+    def call(self, url, request, deadline=None):
+        """
+        Make a request (``request`` is a callable returning ``(response,
+        content)``), retrying as needed. Returns ``(response, content)`` for
+        successful (< 400, including 304) responses; raises ``HttpError``
+        otherwise.
+
+        ``deadline``, if given, is a ``time.time()`` value after which no new
+        attempts are made; ``DeadlineExceeded`` is raised instead.
+        """
+        breaker = self.breaker(url)
+        attempt = 0
+        while True:
+            if deadline is not None and self._clock() >= deadline:
+                raise DeadlineExceeded("Ran out of time before fetching %s" % url)
+            if not breaker.allow():
+                raise CircuitOpen(url)
+
+            try:
+                response, content = request()
+            except CONNECTION_ERRORS, e:
+                error = HttpError(url, reason=str(e) or e.__class__.__name__)
+            else:
+                if response.status < 400:
+                    breaker.success()
+                    return response, content
+                error = HttpError(url, response.status, response.reason)
+                if response.status not in RETRY_STATUSES:
+                    # The host is up, it just didn't like the request.
+                    breaker.success()
+                    raise error
+
+            breaker.failure()
+            if attempt >= self.retries:
+                raise error
+            delay = self.backoff * (2 ** attempt)
+            if deadline is not None and self._clock() + delay >= deadline:
+                raise error
+            self._sleep(delay)
+            attempt += 1
@@ -0,0 +1,102 @@
+"""
+A small pool of keep-alive HTTP clients, kept per host.
+
+``httplib2.Http`` objects hold on to their connections between requests, but
+they aren't thread safe. The pool hands each request an ``Http`` of its own
+and takes it back afterwards, so later requests to the same host reuse the
+open connection instead of paying for a new TCP (and TLS) handshake. Usage::
+
+    >>> pool = HttpPool(size=4, timeout=15)
+    >>> response, content = pool.request("http://example.com/")
+
+At most ``size`` requests to any one host run at once; any more block until
+a client is returned to the pool.
+"""
+
+import threading
+import urlparse
+import httplib2
+
+__all__ = ['HttpPool']
+
+class HttpPool(object):
+
+    def __init__(self, size=4, timeout=15):
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._slots = {}
+
+    def request(self, url, method="GET", body=None, headers=None, username=None, password=None):
+        """
+        Make a request using a pooled client. Returns ``(response, content)``
+        just like ``httplib2.Http.request``.
+        """
+        h = self.acquire(url)
+        try:
+            if username is not None or password is not None:
+                h.add_credentials(username, password)
+            result = h.request(url, method, body, headers)
+        except:
+            # Don't hand a client with a broken connection to the next caller.
+            self.release(url, h, discard=True)
+            raise
+        self.release(url, h)
+        return result
+
+    def acquire(self, url):
+        """
+        Check out a client for the host ``url`` lives on, blocking if all of
+        that host's clients are in use.
+        """
+        host = _host(url)
+        self._lock.acquire()
+        try:
+            slots = self._slots.get(host)
+            if slots is None:
+                slots = self._slots[host] = threading.Semaphore(self.size)
+        finally:
+            self._lock.release()
+
+        slots.acquire()
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(host)
+            if idle:
+                return idle.pop()
+        finally:
+            self._lock.release()
+
+        return httplib2.Http(timeout=self.timeout)
+
+    def release(self, url, h, discard=False):
+        """
+        Return a client to the pool. If ``discard`` is true the client is
+        thrown away instead, but its slot is still freed up.
+        """
+        # Credentials are per-request; don't let them leak to the next user.
+        h.clear_credentials()
+        host = _host(url)
+        self._lock.acquire()
+        try:
+            if not discard:
+                self._idle.setdefault(host, []).append(h)
+            slots = self._slots[host]
+        finally:
+            self._lock.release()
+        slots.release()
+
+    def clear(self):
+        """
+        Drop all idle clients (and so their connections).
+        """
+        self._lock.acquire()
+        try:
+            self._idle.clear()
+        finally:
+            self._lock.release()
+
+def _host(url):
+    scheme, netloc = urlparse.urlsplit(url)[:2]
+    return "%s://%s" % (scheme, netloc)
@@ -0,0 +1,85 @@
+"""
+Token-bucket rate limiting for API clients. Usage::
+
+    >>> bucket = TokenBucket(rate=0.5, burst=1)
+    >>> bucket.acquire()    # returns at once
+    >>> bucket.acquire()    # sleeps for ~2 seconds
+
+A bucket holds up to ``burst`` tokens and refills at ``rate`` tokens per
+second; each call takes a token, sleeping if there isn't one. Buckets are
+safe to share between threads. Give a bucket a ``lockfile`` and its state is
+kept in that file under an exclusive lock instead, so every process pointed
+at the same file shares a single bucket (on platforms without ``fcntl`` this
+quietly falls back to a per-process bucket).
+"""
+
+import os
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ['TokenBucket']
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst=1, lockfile=None, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.lockfile = fcntl is not None and lockfile or None
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = clock()
+
+    def acquire(self, tokens=1):
+        """
+        Take ``tokens`` from the bucket, sleeping until they're available.
+        """
+        while True:
+            wait = self._take(tokens)
+            if wait <= 0:
+                return
+            self._sleep(wait)
+
+    def _take(self, tokens):
+        """
+        Try to take some tokens. Returns 0 on success, otherwise the number
+        of seconds until there should be enough.
+        """
+        self._lock.acquire()
+        try:
+            if self.lockfile:
+                return self._take_shared(tokens)
+            self._tokens, self._updated, wait = self._refill(self._tokens, self._updated, tokens)
+            return wait
+        finally:
+            self._lock.release()
+
+    def _take_shared(self, tokens):
+        fd = os.open(self.lockfile, os.O_RDWR | os.O_CREAT, 0644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                available, updated = map(float, os.read(fd, 100).split())
+            except ValueError:
+                available, updated = self.burst, self._clock()
+            available, updated, wait = self._refill(available, updated, tokens)
+            os.lseek(fd, 0, 0)
+            os.ftruncate(fd, 0)
+            os.write(fd, "%r %r" % (available, updated))
+            return wait
+        finally:
+            # Closing the file releases the lock.
+            os.close(fd)
+
+    def _refill(self, available, updated, tokens):
+        now = self._clock()
+        available = min(self.burst, available + max(0, now - updated) * self.rate)
+        if available >= tokens:
+            return available - tokens, now, 0
+        return available, now, (tokens - available) / self.rate
@@ -28,7 +28,15 @@ def update():
     max_results = 50
     while True:
         log.debug("Fetching videos %s - %s" % (start_index, start_index+max_results-1))
-        feed = feedparser.parse(FEED_URL % (settings.YOUTUBE_USERNAME, start_index, max_results))
+        # If the first page of favorites hasn't changed since last time,
+        # there's nothing new to see.
+        try:
+            body = utils.fetch_resource(FEED_URL % (settings.YOUTUBE_USERNAME, start_index, max_results),
+                                        conditional=(start_index == 1))
+        except utils.NotModified:
+            log.info("Skipping update: favorites haven't changed")
+            break
+        feed = feedparser.parse(body)
         for entry in feed.entries:            
             if 'link' in entry:
                 url = entry.link
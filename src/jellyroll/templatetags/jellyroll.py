@@ -1,19 +1,24 @@
 import datetime
 import dateutil.parser
+import hashlib
 import urllib
 from django import template
+from django.core.cache import cache
 from django.db import models
-from django.template.loader import render_to_string
+from django.conf import settings
+from django.template.loader import select_template
+from django.utils.functional import SimpleLazyObject
+from django.utils.importlib import import_module
+from django.utils.safestring import mark_safe
 from django.contrib.contenttypes.models import ContentType
 
-try:
-    from collections import defaultdict
-except ImportError:
-    defaultdict = None
-
 
 # Hack until relative imports
 Item = models.get_model("jellyroll", "item")
+managers = import_module("jellyroll.managers")
+items_generation = managers.items_generation
+prerender_enabled = managers.prerender_enabled
+snippet_version = managers.snippet_version
 
 register = template.Library()
 
@@ -41,7 +46,19 @@ def jellyrender(parser, token):
             The jellyroll ``Item`` object
     
         ``object``
-            The actual object (i.e. ``item.object``).
+            The actual object (i.e. ``item.object``). It's only loaded from
+            the database if the template uses it.
+            
+        ``payload``
+            The display data the object's model stored on the item (see
+            ``jellyroll_payload()``), as a dict. Snippets that stick to
+            ``item`` and ``payload`` render without touching the object's
+            table at all.
+    
+    With the JELLYROLL_PRERENDER setting on, Items' HTML and text snippets are
+    rendered once when they're ingested, and served from the Item from then
+    on (see ``ItemManager.prerender``). That's only done without ``using``,
+    or with ``using "jellyroll/snippets/item.txt"``.
             
     The rendered content will be displayed in the template unless the ``as
     <varname>`` clause is used to redirect the output into a context variable.
@@ -49,24 +66,112 @@ def jellyrender(parser, token):
     bits = token.split_contents()
     if len(bits) < 2:
         raise template.TemplateSyntaxError("%r tag takes at least one argument" % bits[0])
+    return JellyrenderNode(bits[1], **_parse_render_clauses(bits))
+jellyrender = register.tag(jellyrender)
+
+def jellyrender_list(parser, token):
+    """
+    Render a list of jellyroll ``Item`` objects (or of objects that have
+    Items), one after the other, just like ``jellyrender`` would render each.
     
-    item = bits[1]
-    args = {}
+    ::
+    
+        {% jellyrender_list <items> [using <template>] [as <varname>] %}
     
-    # Parse out extra clauses if given
-    if len(bits) > 2:
-        biter = iter(bits[2:])
-        for bit in biter:
+    Items for the objects that aren't Items are looked up all at once, rather
+    than one query per object.
+    """
+    bits = token.split_contents()
+    if len(bits) < 2:
+        raise template.TemplateSyntaxError("%r tag takes at least one argument" % bits[0])
+    return JellyrenderListNode(bits[1], **_parse_render_clauses(bits))
+jellyrender_list = register.tag(jellyrender_list)
+
+def _parse_render_clauses(bits):
+    """Parse the ``using`` and ``as`` clauses of jellyrender and friends."""
+    args = {}
+    biter = iter(bits[2:])
+    for bit in biter:
+        try:
             if bit == "using":
                 args["using"] = biter.next()
             elif bit == "as":
                 args["asvar"] = biter.next()
             else:
                 raise template.TemplateSyntaxError("%r tag got an unknown argument: %r" % (bits[0], bit))
-            
-    return JellyrenderNode(item, **args)
-jellyrender = register.tag(jellyrender)
+        except StopIteration:
+            raise template.TemplateSyntaxError("%r tag: ran out of arguments when parsing %r clause" % (bits[0], bit))
+    return args
+
+# Compiled snippet templates, by (model name, using).
+_snippet_templates = {}
+
+def snippet_template(model_name, using=None):
+    """
+    Return the compiled snippet template for a model: ``using`` if given
+    (and it exists), then ``jellyroll/snippets/<model_name>.html``, then
+    ``jellyroll/snippets/item.html``.
     
+    Template lookups are remembered, unless TEMPLATE_DEBUG is on (so that
+    template changes show up during development).
+    """
+    key = (model_name, using)
+    if key in _snippet_templates:
+        return _snippet_templates[key]
+    
+    template_list = [
+        "jellyroll/snippets/%s.html" % model_name, 
+        "jellyroll/snippets/item.html"
+    ]
+    if using:
+        template_list.insert(0, using)
+    t = select_template(template_list)
+    if not settings.TEMPLATE_DEBUG:
+        _snippet_templates[key] = t
+    return t
+
+# The text snippet, which can be stored (like the HTML one) at ingest time.
+TEXT_SNIPPET = "jellyroll/snippets/item.txt"
+
+def render_item(item, object=None, using=None, context=None, stored=True):
+    """
+    Render an Item through its snippet template. ``object`` is the Item's
+    object if the caller started out with that rather than the Item.
+    
+    If JELLYROLL_PRERENDER is on and the Item has output stored for the
+    current JELLYROLL_SNIPPET_VERSION (see ``ItemManager.prerender``), that's
+    returned instead of rendering -- unless ``stored`` is False.
+    """
+    if stored and prerender_enabled() and item.rendered_version == snippet_version():
+        if using is None:
+            return mark_safe(item.rendered_html)
+        if using == TEXT_SNIPPET:
+            return mark_safe(item.rendered_text)
+    
+    if context is None:
+        context = template.Context()
+    if object is not None:
+        model_name = type(object).__name__.lower()
+        
+    # Only load the object if the snippet actually uses it.
+    elif hasattr(item, "_object_cache"):
+        object = item.object
+        model_name = item.content_type.model
+    else:
+        object = SimpleLazyObject(lambda: item.object)
+        model_name = item.content_type.model
+    
+    context.push()
+    context.update({
+        "item" : item,
+        "object" : object,
+        "payload" : item.payload,
+    })
+    try:
+        return snippet_template(model_name, using).render(context)
+    finally:
+        context.pop()
+
 class JellyrenderNode(template.Node):
         
     def __init__(self, item, using=None, asvar=None):
@@ -79,45 +184,56 @@ class JellyrenderNode(template.Node):
             item = template.resolve_variable(self.item, context)
         except template.VariableDoesNotExist:
             return ""
-                
-        if isinstance(item, Item):
-            object = item.object
         
         # If the item isn't an Item, try to look one up.
-        else:
+        object = None
+        if not isinstance(item, Item):
             object = item
-            ct = ContentType.objects.get_for_model(item)
             try:
-                item = Item.objects.get(content_type=ct, object_id=object._get_pk_val())
+                item = Item.objects.get_for_object(object)
             except Item.DoesNotExist:
                 return ""
                 
-        # Figure out which templates to use
-        template_list = [
-            "jellyroll/snippets/%s.html" % type(object).__name__.lower(), 
-            "jellyroll/snippets/item.html"
-        ]
+        return self.output(render_item(item, object, self.resolve_using(context), context), context)
+        
+    def resolve_using(self, context):
         if self.using:
             try:
-                using = template.resolve_variable(self.using, context)
+                return template.resolve_variable(self.using, context)
             except template.VariableDoesNotExist:
                 pass
-            else:
-                template_list.insert(0, using)
-                
-        # Render content, and save to self.asvar if requested
-        context.push()
-        context.update({
-            "item" : item,
-            "object" : object
-        })
-        rendered = render_to_string(template_list, context)
-        context.pop()
+        return None
+        
+    def output(self, rendered, context):
+        """Return the rendered content, or save it to self.asvar if requested."""
         if self.asvar:
             context[self.asvar] = rendered
             return ""
         else:
             return rendered
+
+class JellyrenderListNode(JellyrenderNode):
+    
+    def render(self, context):
+        try:
+            items = list(template.resolve_variable(self.item, context) or [])
+        except template.VariableDoesNotExist:
+            return ""
+        
+        # Look up the Items for any objects in one go.
+        objects = [i for i in items if not isinstance(i, Item)]
+        found = dict(zip(map(id, objects), Item.objects.get_for_objects(objects)))
+        
+        using = self.resolve_using(context)
+        rendered = []
+        for item in items:
+            object = None
+            if not isinstance(item, Item):
+                object, item = item, found[id(item)]
+                if item is None:
+                    continue
+            rendered.append(render_item(item, object, using, context))
+        return self.output(mark_safe(u"".join(rendered)), context)
             
 def get_jellyroll_items(parser, token):
     """
@@ -163,6 +279,19 @@ def get_jellyroll_items(parser, token):
         
     You can give ``excludetype`` as many times as you like, but it is an error
     to use both ``oftype`` and ``excludetype`` in the same tag invocation.
+    
+    The items aren't loaded until the template uses them, and the first loop
+    over them streams the items from the database (with their objects) a
+    chunk at a time. After that they behave just like a list. To hold on to
+    the items between requests, ask for them to be cached for a number of
+    seconds::
+    
+        {% get_jellyroll_items limit 10 cached 300 as items %}
+        
+    Cached items are shared by every use of the tag with the same arguments,
+    and are thrown away as soon as any Items change -- provided whatever
+    changes them (usually the ``jellyroll_update`` cron job) shares the
+    site's cache; see ``jellyroll.managers.items_generation``.
     """
     
     # Parse out the arguments
@@ -189,6 +318,11 @@ def get_jellyroll_items(parser, token):
                 args.setdefault("excludetypes", []).append(bits.next())
             elif bit == "reversed":
                 args["reversed"] = True
+            elif bit == "cached":
+                try:
+                    args["cached"] = int(bits.next())
+                except ValueError:
+                    raise template.TemplateSyntaxError("%r tag: 'cached' requires an integer argument" % tagname)
             elif bit == "as":
                 args["asvar"] = bits.next()
             else:
@@ -222,8 +356,54 @@ def get_jellyroll_items(parser, token):
     return GetJellyrollItemsNode(**args)
 get_jellyroll_items = register.tag(get_jellyroll_items)
 
+class LazyItems(object):
+    """
+    What get_jellyroll_items puts in the context: a read-only, list-like view
+    of a QuerySet of Items that isn't loaded until it's used.
+    
+    The first loop over it streams the Items from the database (see
+    ``ItemQuerySet.with_objects``) as it goes, remembering them; ``len()``,
+    indexing and later loops are served from what was remembered, loading
+    everything first if need be. Like a list, it only ever runs its query once.
+    """
+    
+    def __init__(self, queryset):
+        self.queryset = queryset
+        self._result_cache = None
+        
+    def __iter__(self):
+        if self._result_cache is not None:
+            return iter(self._result_cache)
+        return self._stream()
+        
+    def _stream(self):
+        results = []
+        for item in self.queryset.iterator():
+            results.append(item)
+            yield item
+        self._result_cache = results
+        
+    def _fetch_all(self):
+        if self._result_cache is None:
+            self._result_cache = list(self.queryset.iterator())
+        return self._result_cache
+        
+    def __reversed__(self):
+        return reversed(self._fetch_all())
+        
+    def __len__(self):
+        return len(self._fetch_all())
+        
+    def __nonzero__(self):
+        return bool(self._fetch_all())
+        
+    def __getitem__(self, k):
+        if not isinstance(k, (int, long, slice)):
+            raise TypeError
+        return self._fetch_all()[k]
+
 class GetJellyrollItemsNode(template.Node):
-    def __init__(self, asvar, limit=None, start=None, end=None, oftypes=[], excludetypes=[], reversed=False):
+    def __init__(self, asvar, limit=None, start=None, end=None, oftypes=(), excludetypes=(), reversed=False, cached=None):
         self.asvar = asvar
         self.limit = limit
         self.start = start
@@ -231,9 +411,22 @@ class GetJellyrollItemsNode(template.Node):
         self.oftypes = oftypes
         self.excludetypes = excludetypes
         self.reversed = reversed
+        self.cached = cached
+        self._type_ids = None
+        
+    def type_ids(self):
+        """
+        Return the content type ids for oftypes and excludetypes. Content types
+        don't change, so they're only looked up once -- but not before the
+        first render, so loading a template doesn't touch the database.
+        """
+        if self._type_ids is None:
+            CT = ContentType.objects.get_for_model
+            self._type_ids = ([CT(m).id for m in self.oftypes], [CT(m).id for m in self.excludetypes])
+        return self._type_ids
         
     def render(self, context):
-        qs = Item.objects.all()
+        qs = Item.objects.with_objects()
         
         # Handle start/end dates if given
         if self.start:
@@ -244,11 +437,11 @@ class GetJellyrollItemsNode(template.Node):
             qs = qs.filter(timestamp__range=(start, end))
             
         # Handle types
-        CT = ContentType.objects.get_for_model
-        if self.oftypes:
-            qs = qs.filter(content_type__id__in=[CT(m).id for m in self.oftypes])
-        if self.excludetypes:
-            qs = qs.exclude(content_type__id__in=[CT(m).id for m in self.excludetypes])
+        oftype_ids, excludetype_ids = self.type_ids()
+        if oftype_ids:
+            qs = qs.filter(content_type__id__in=oftype_ids)
+        if excludetype_ids:
+            qs = qs.exclude(content_type__id__in=excludetype_ids)
             
         # Handle reversed
         if self.reversed:
@@ -260,10 +453,35 @@ class GetJellyrollItemsNode(template.Node):
         if self.limit:
             qs = qs[:self.limit]
             
-        # Set the context
-        context[self.asvar] = list(qs)
+        # Set the context, from the cache if asked to
+        if self.cached:
+            key = self.cache_key(context)
+            items = cache.get(key)
+            if items is None:
+                items = list(qs)
+                cache.set(key, items, self.cached)
+            context[self.asvar] = items
+        else:
+            context[self.asvar] = LazyItems(qs)
         return ""
         
+    def cache_key(self, context):
+        """
+        Key for cached results: everything that goes into the query, plus the
+        Item generation. Dates go in unparsed, so that "now" doesn't make
+        every key different.
+        """
+        dates = []
+        for d in (self.start, self.end):
+            if d:
+                try:
+                    d = template.resolve_variable(d, context)
+                except template.VariableDoesNotExist:
+                    pass
+            dates.append(d)
+        key = repr((self.limit, dates, self.type_ids(), self.reversed))
+        return "jellyroll.items:%s:%s" % (items_generation(), hashlib.md5(key).hexdigest())
+        
     def resolve_date(self, d, context):
         """Resolve start/end, handling literals"""
         try:
@@ -286,47 +504,67 @@ class GetJellyrollItemsNode(template.Node):
             return None
 
 def get_jellyroll_recent_traffic(parser, token):
-    oftypes = []
+    """
+    Load counts of recent jellyroll ``Item`` objects, one per day, into the
+    context -- handy for sparklines.
+    
+    ::
+    
+        {% get_jellyroll_recent_traffic <days> as <varname> [<type>,<type>...] %}
+        
+    Without types the variable is a list of counts of all items, for
+    yesterday and then each of the ``days - 1`` days before it. With types
+    (the lowercased class names of jellyroll'd items), it's a dict mapping
+    each type name to such a list.
+    
+    The counts come from one grouped query, and are cached until the next
+    time Items change (or the day does).
+    """
     bits = token.split_contents()
     if len(bits) < 4 or len(bits) > 5:
         raise template.TemplateSyntaxError("%r tag takes three arguments" % bits[0])
     elif bits[2] != 'as':
         raise template.TemplateSyntaxError("second argument to %r tag should be 'as'" % bits[0])
+    oftypes = []
     if len(bits) > 4:
-        oftypes = bits[4]
+        oftypes = bits[4].split(",")
+        for name in oftypes:
+            if name not in Item.objects.models_by_name:
+                raise template.TemplateSyntaxError("%r tag: invalid model name: %r" % (bits[0], name))
     return JellyrollRecentTrafficNode(bits[1],bits[3],oftypes)
 get_jellyroll_recent_traffic = register.tag(get_jellyroll_recent_traffic)
 
 class JellyrollRecentTrafficNode(template.Node):
-    def __init__(self, days, context_var, oftypes=[]):
+    def __init__(self, days, context_var, oftypes=()):
         self.days = int(days)
-        self.oftypes = oftypes.split(",")
+        self.oftypes = list(oftypes)
         self.context_var = context_var
 
     def render(self, context):
-        CT = ContentType.objects.get_for_model
-        dt_start = datetime.date.today()
-        data = []
-
-        if self.oftypes:
-            if defaultdict:
-                data = defaultdict(list)
-            else:
-                for item_type in self.oftypes: data[item_type] = []
-
-        for offset in range(0,self.days):
-            dt = dt_start - datetime.timedelta(days=offset)
-            step = datetime.timedelta(days=1)
-            if self.oftypes:
-                for item_type in self.oftypes:
-                    qs = Item.objects.filter(content_type__id=CT(Item.objects.models_by_name[item_type]).id)
-                    data[item_type].append(
-                        qs.filter(timestamp__range=(dt-step,dt)).count()
-                        )
-            else:
-                data.append(
-                    Item.objects.filter(timestamp__range=(dt-step,dt)).count()
-                    )
-
+        today = datetime.date.today()
+        key = "jellyroll.recent_traffic:%s:%s:%s:%s" % (
+            items_generation(), today, self.days, ",".join(self.oftypes))
+        data = cache.get(key)
+        if data is None:
+            data = self.traffic(today)
+            cache.set(key, data)
         context[self.context_var] = data
         return ''
+        
+    def traffic(self, today):
+        # Offset 0 is yesterday, offset 1 the day before, and so on.
+        days = [today - datetime.timedelta(days=offset+1) for offset in range(self.days)]
+        if not self.oftypes:
+            counts = Item.objects.daily_counts(today - datetime.timedelta(days=self.days), today)
+            totals = {}
+            for (day, ctype_id), count in counts.items():
+                totals[day] = totals.get(day, 0) + count
+            return [totals.get(day, 0) for day in days]
+        
+        models = [Item.objects.models_by_name[name] for name in self.oftypes]
+        counts = Item.objects.daily_counts(today - datetime.timedelta(days=self.days), today, models)
+        data = {}
+        for name, model in zip(self.oftypes, models):
+            ctype_id = ContentType.objects.get_for_model(model).pk
+            data[name] = [counts.get((day, ctype_id), 0) for day in days]
+        return data
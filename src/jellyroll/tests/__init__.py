@@ -4,4 +4,7 @@ from jellyroll.tests.test_views import *
 from jellyroll.tests.test_misc import *
 from jellyroll.tests.providers.test_delicious import *
 from jellyroll.tests.providers.test_flickr import *
-from jellyroll.tests.providers.test_latitude import *
\ No newline at end of file
+from jellyroll.tests.providers.test_lastfm import *
+from jellyroll.tests.providers.test_latitude import *
+from jellyroll.tests.providers.test_twitter import *
+from jellyroll.tests.providers.test_utils import *
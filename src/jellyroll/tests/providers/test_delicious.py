@@ -3,7 +3,7 @@ import datetime
 import unittest
 from django.conf import settings
 from django.test import TestCase
-from jellyroll.models import Item, Bookmark
+from jellyroll.models import Item, Bookmark, SyncState
 from jellyroll.providers import delicious
 from jellyroll.providers.utils.anyetree import etree
 
@@ -30,6 +30,18 @@ class DeliciousClientTests(unittest.TestCase):
             username = 'username',
             password = 'password'
         )
+        
+    @mock.patch('jellyroll.providers.utils.iterxml')
+    def test_client_iterate(self, mocked):
+        c = delicious.DeliciousClient('username', 'password')
+        res = c.foo.bar.iterate('baz', a=1)
+        
+        mocked.assert_called_with(
+            'https://api.del.icio.us/v1/foo/bar?a=1',
+            'baz',
+            username = 'username',
+            password = 'password'
+        )
 
 #    
 # Fake delicious client that mocks all the calls update() makes.
@@ -47,13 +59,13 @@ FakeClient.posts.update.return_value = xml(
     '<update time="2009-08-18T15:30:16Z" inboxnew="0"/>'
 )
 
-FakeClient.posts.dates.return_value = xml('''
+FakeClient.posts.dates.iterate.return_value = xml('''
     <dates tag="" user="jellyroll">
         <date count="1" date="2009-08-18"/>
     </dates>
-''')
+''').findall('date')
 
-FakeClient.posts.get.return_value = xml('''
+FakeClient.posts.get.iterate.return_value = xml('''
     <posts user="jellyroll" dt="2009-08-18T15:30:16Z">
         <post href="http://jacobian.org/"
               hash="151ebb66839faa8ed073b27fb897b166"
@@ -63,7 +75,7 @@ FakeClient.posts.get.return_value = xml('''
               tag="me jacob jacobian"
         />
     </posts>
-''')
+''').findall('post')
 
 class DeliciousProviderTests(TestCase):
     
@@ -77,8 +89,8 @@ class DeliciousProviderTests(TestCase):
         # Check that the calls to the API match what we expect
         FakeClient.assert_called_with(settings.DELICIOUS_USERNAME, settings.DELICIOUS_PASSWORD)
         FakeClient.posts.update.assert_called_with()
-        FakeClient.posts.dates.assert_called_with()
-        FakeClient.posts.get.assert_called_with(dt='2009-08-18')
+        FakeClient.posts.dates.iterate.assert_called_with('date')
+        FakeClient.posts.get.iterate.assert_called_with('post', dt='2009-08-18')
         
         # Check that the bookmark exists
         b = Bookmark.objects.get(url="http://jacobian.org/")
@@ -88,6 +100,11 @@ class DeliciousProviderTests(TestCase):
         i = Item.objects.get(content_type__model='bookmark', object_id=b.pk)
         self.assertEqual(i.timestamp.date(), datetime.date(2009, 8, 18))
         self.assertEqual(i.tags, 'me jacob jacobian')
+        
+        # Check that the sync state was recorded
+        state = SyncState.objects.get(provider=delicious.__name__)
+        self.assertEqual(state.last_timestamp, i.timestamp)
+        self.assert_(state.last_success is not None)
     
     @mock.patch_object(delicious, 'DeliciousClient', FakeClient)
     @mock.patch_object(delicious, 'log')
@@ -5,7 +5,7 @@ import datetime
 import unittest
 from django.conf import settings
 from django.test import TestCase
-from jellyroll.models import Item, Photo
+from jellyroll.models import Item, Photo, SyncState
 from jellyroll.providers import flickr, utils
 
 class FlickrClientTests(unittest.TestCase):
@@ -170,5 +170,19 @@ class FlickrProviderTests(TestCase):
         i = Item.objects.get(content_type__model='photo', object_id=p.pk)
         self.assertEqual(i.timestamp.date(), datetime.date(2009, 7, 21))
         self.assertEqual(i.tags, 'burrito')
+        
+        # Check that the sync state was recorded, and the page cursor cleared
+        state = SyncState.objects.get(provider=flickr.__name__)
+        self.assertEqual(state.last_timestamp, datetime.datetime(2009, 7, 21, 11, 45, 6))
+        self.assertEqual(state.cursor, {})
     
-
+    @mock.patch_object(flickr, 'FlickrClient', FakeClient)
+    def test_update_resumes_from_cursor(self):
+        SyncState.objects.create(provider=flickr.__name__, 
+                                 last_timestamp=datetime.datetime(2009, 1, 1),
+                                 _cursor='{"page": 2}')
+        flickr.update()
+        
+        # Page 2 is past the end, so nothing should have been fetched.
+        self.assertEqual(Photo.objects.count(), 0)
+        self.assertEqual(SyncState.objects.get(provider=flickr.__name__).cursor, {})
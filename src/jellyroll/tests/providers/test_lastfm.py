@@ -0,0 +1,36 @@
+import mock
+import unittest
+from jellyroll.providers import lastfm, utils
+from jellyroll.providers.utils.anyetree import etree
+
+TAGS_XML = """<toptags>
+  <tag><name>Post Rock</name><count>100</count></tag>
+  <tag><name>seen live</name><count>2</count></tag>
+</toptags>"""
+
+class LastfmTagTests(unittest.TestCase):
+    
+    def setUp(self):
+        lastfm._tag_cache.clear()
+        self.getxml = utils.getxml
+        self.ratelimit = utils.ratelimit
+        utils.ratelimit = mock.Mock()
+        
+    def tearDown(self):
+        utils.getxml = self.getxml
+        utils.ratelimit = self.ratelimit
+        lastfm._tag_cache.clear()
+        
+    def test_tags_for_url(self):
+        utils.getxml = mock.Mock(return_value=etree.fromstring(TAGS_XML))
+        self.assertEqual(lastfm._tags_for_url("http://example.com/"), set(["post-rock"]))
+        self.assertEqual(lastfm._tags_for_url("http://example.com/"), set(["post-rock"]))
+        self.assertEqual(utils.getxml.call_count, 1)
+        
+    def test_failures_not_memoized(self):
+        utils.getxml = mock.Mock(side_effect=utils.HttpError("http://example.com/", 503))
+        self.assertEqual(lastfm._tags_for_url("http://example.com/"), set())
+        self.assert_(("http://example.com/",) not in lastfm._tag_cache)
+        
+        utils.getxml = mock.Mock(return_value=etree.fromstring(TAGS_XML))
+        self.assertEqual(lastfm._tags_for_url("http://example.com/"), set(["post-rock"]))
@@ -0,0 +1,38 @@
+import mock
+from django.conf import settings
+from django.test import TestCase
+from jellyroll.models import Item, Message
+from jellyroll.providers import twitter, utils
+from jellyroll.providers.utils.anyetree import etree
+
+STATUSES = etree.fromstring('''<rss><channel>
+  <item>
+    <title>jellyroll: Reading http://example.com/ with @jacobian #django</title>
+    <link>http://twitter.com/jellyroll/statuses/12345</link>
+    <pubDate>Tue, 18 Aug 2009 15:30:16 +0000</pubDate>
+  </item>
+</channel></rss>''').findall('channel/item')
+
+class TwitterTransformTests(TestCase):
+    
+    def setUp(self):
+        settings.TWITTER_TRANSFORM_MSG = True
+        settings.TWITTER_RETWEET_TXT = "Forwarding from %s: "
+        reload(twitter)
+        
+    def tearDown(self):
+        del settings.TWITTER_TRANSFORM_MSG
+        del settings.TWITTER_RETWEET_TXT
+        reload(twitter)
+        
+    @mock.patch('jellyroll.providers.utils.iterxml')
+    def test_update_twice(self, mocked):
+        mocked.return_value = STATUSES
+        twitter.update()
+        twitter.update()
+        
+        self.assertEqual(Message.objects.count(), 1)
+        self.assertEqual(Item.objects.filter(source=twitter.__name__).count(), 1)
+        message = Message.objects.get()
+        self.assert_(message.message.startswith("Reading [1] with <a href="))
+        self.assertEqual(Item.objects.get_for_object(message).tags, "django")
@@ -0,0 +1,290 @@
+from __future__ import with_statement
+
+import os
+import mock
+import shutil
+import socket
+import StringIO
+import tempfile
+import unittest
+import httplib2
+import dateutil.parser
+import dateutil.tz
+from django.conf import settings
+from jellyroll.providers import utils
+from jellyroll.providers.utils import dates
+from jellyroll.providers.utils.pool import HttpPool
+from jellyroll.providers.utils.httpcache import ResponseCache
+from jellyroll.providers.utils.ratelimit import TokenBucket
+from jellyroll.providers.utils.policy import FetchPolicy
+
+class HttpPoolTests(unittest.TestCase):
+    
+    def test_reuse(self):
+        pool = HttpPool(size=2)
+        h = pool.acquire("http://example.com/a")
+        pool.release("http://example.com/a", h)
+        self.assert_(pool.acquire("http://example.com/b") is h)
+        
+    def test_per_host(self):
+        pool = HttpPool(size=2)
+        h = pool.acquire("http://example.com/")
+        pool.release("http://example.com/", h)
+        self.assert_(pool.acquire("http://example.org/") is not h)
+        
+    def test_credentials_cleared(self):
+        pool = HttpPool(size=1)
+        h = pool.acquire("https://example.com/")
+        h.add_credentials("username", "password")
+        pool.release("https://example.com/", h)
+        self.assertEqual(list(pool.acquire("https://example.com/").credentials.iter("")), [])
+
+class BatchTests(unittest.TestCase):
+    
+    def test_batch_order(self):
+        calls = [(pow, (i, 2), {}) for i in range(10)]
+        self.assertEqual(utils.batch(calls, workers=3), [i*i for i in range(10)])
+        
+    def test_batch_errors(self):
+        calls = [(int, ("1",), {}), (int, ("frog",), {})]
+        self.assertRaises(ValueError, utils.batch, calls, workers=2)
+        
+    def test_fetch_many(self):
+        mocked = mock.Mock(return_value=(httplib2.Response({}), "body"))
+        with mock.patch_object(utils.http_pool, 'request', mocked):
+            self.assertEqual(utils.fetch_many(["http://a/", "http://b/"]), ["body", "body"])
+        self.assertEqual(mocked.call_count, 2)
+        
+    def test_fetch_many_deadline(self):
+        mocked = mock.Mock(return_value=(httplib2.Response({}), "body"))
+        settings.JELLYROLL_PROVIDER_DEADLINE = -1
+        utils.start_run()
+        try:
+            with mock.patch_object(utils.http_pool, 'request', mocked):
+                self.assertRaises(utils.DeadlineExceeded, utils.fetch_many, ["http://a/", "http://b/"])
+        finally:
+            utils.finish_run()
+            del settings.JELLYROLL_PROVIDER_DEADLINE
+        self.assertEqual(mocked.call_count, 0)
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0
+    def time(self):
+        return self.now
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+class TokenBucketTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.clock = FakeClock()
+        
+    def bucket(self, **kwargs):
+        return TokenBucket(clock=self.clock.time, sleep=self.clock.sleep, **kwargs)
+        
+    def test_burst(self):
+        bucket = self.bucket(rate=1, burst=3)
+        for i in range(3):
+            bucket.acquire()
+        self.assertEqual(self.clock.slept, 0)
+        bucket.acquire()
+        self.assertEqual(self.clock.slept, 1)
+        
+    def test_rate(self):
+        bucket = self.bucket(rate=0.5, burst=1)
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual(self.clock.slept, 2)
+        
+    def test_shared(self):
+        dir = tempfile.mkdtemp()
+        try:
+            lockfile = os.path.join(dir, "test.bucket")
+            b1 = self.bucket(rate=1, burst=1, lockfile=lockfile)
+            b2 = self.bucket(rate=1, burst=1, lockfile=lockfile)
+            b1.acquire()
+            b2.acquire()
+            self.assertEqual(self.clock.slept, 1)
+        finally:
+            shutil.rmtree(dir)
+
+class FetchPolicyTests(unittest.TestCase):
+    
+    url = "http://example.com/"
+    
+    def setUp(self):
+        self.clock = FakeClock()
+        
+    def policy(self, **kwargs):
+        return FetchPolicy(clock=self.clock.time, sleep=self.clock.sleep, **kwargs)
+        
+    def request(self, *statuses):
+        responses = [(httplib2.Response({'status': s}), "body") for s in statuses]
+        return mock.Mock(side_effect=lambda: responses.pop(0))
+        
+    def test_retry_with_backoff(self):
+        request = self.request(503, 503, 200)
+        self.assertEqual(self.policy(retries=2, backoff=1).call(self.url, request)[1], "body")
+        self.assertEqual(request.call_count, 3)
+        self.assertEqual(self.clock.slept, 3)
+        
+    def test_gives_up(self):
+        request = self.request(500, 500)
+        self.assertRaises(utils.HttpError, self.policy(retries=1).call, self.url, request)
+        self.assertEqual(request.call_count, 2)
+        
+    def test_client_errors_not_retried(self):
+        request = self.request(404)
+        try:
+            self.policy().call(self.url, request)
+        except utils.HttpError, e:
+            self.assertEqual(e.code, 404)
+        else:
+            self.fail("HttpError not raised")
+        self.assertEqual(request.call_count, 1)
+        
+    def test_connection_errors_retried(self):
+        results = [socket.timeout("timed out"), (httplib2.Response({}), "body")]
+        def request():
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        self.assertEqual(self.policy().call(self.url, request)[1], "body")
+        
+    def test_circuit_breaker(self):
+        policy = self.policy(retries=0, threshold=2, cooldown=60)
+        for i in range(2):
+            self.assertRaises(utils.HttpError, policy.call, self.url, self.request(503))
+        
+        # The circuit is open: fail without making a request...
+        request = self.request(200)
+        self.assertRaises(utils.CircuitOpen, policy.call, self.url, request)
+        self.assertEqual(request.call_count, 0)
+        
+        # ... other hosts are fine ...
+        policy.call("http://example.org/", self.request(200))
+        
+        # ... and after the cooldown a trial request is let through.
+        self.clock.now += 60
+        policy.call(self.url, request)
+        self.assertEqual(request.call_count, 1)
+        
+    def test_deadline(self):
+        request = self.request(200)
+        self.assertRaises(utils.DeadlineExceeded, self.policy().call, self.url, request, deadline=self.clock.now)
+        self.assertEqual(request.call_count, 0)
+
+class DateParsingTests(unittest.TestCase):
+    
+    samples = [
+        "2009-08-18",
+        "2009-08-18T15:30:16Z",
+        "2009-07-21 11:45:06",
+        "2009-08-18T15:30:16.250+02:00",
+        "Tue, 18 Aug 2009 15:30:16 +0000",
+        "Tue, 18 Aug 2009 15:30:16 GMT",
+        "August 18, 2009 3:30pm",
+    ]
+    
+    def test_matches_dateutil(self):
+        for s in self.samples:
+            self.assertEqual(dates.parse(s), dateutil.parser.parse(s))
+            self.assertEqual(repr(dates.parse(s).tzinfo), repr(dateutil.parser.parse(s).tzinfo))
+            
+    def test_parsedate_local(self):
+        expected = dateutil.parser.parse("2009-08-18T15:30:16Z").astimezone(dateutil.tz.tzlocal()).replace(tzinfo=None)
+        self.assertEqual(utils.parsedate("2009-08-18T15:30:16Z"), expected)
+        self.assertEqual(utils.parsedate("Tue, 18 Aug 2009 15:30:16 +0000"), expected)
+        
+    def test_to_local(self):
+        aware = dates.parse("2009-08-18T15:30:16Z")
+        self.assertEqual(dates.to_local(aware), utils.parsedate("2009-08-18T15:30:16Z"))
+        self.assertEqual(dates.to_local(aware.replace(tzinfo=None)), aware.replace(tzinfo=None))
+
+class IterparseTests(unittest.TestCase):
+    
+    def test_iterparse(self):
+        source = StringIO.StringIO("<a><b>1</b><c><b>2</b></c><d>3</d></a>")
+        self.assertEqual([e.text for e in utils.iterparse(source, "b")], ["1", "2"])
+        
+    def test_iterparse_multiple_tags(self):
+        source = StringIO.StringIO("<a><b>1</b><c><b>2</b></c><d>3</d></a>")
+        self.assertEqual([e.text for e in utils.iterparse(source, ["b", "d"])], ["1", "2", "3"])
+
+class ResponseCacheTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = ResponseCache(self.dir, max_size=1000)
+        
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+        
+    def test_validators(self):
+        key = self.cache.key("http://example.com/")
+        self.assertEqual(self.cache.conditional_headers(key), {})
+        self.cache.set(key, httplib2.Response({'etag': '"abc"'}), "body")
+        self.assertEqual(self.cache.conditional_headers(key), {'if-none-match': '"abc"'})
+        self.assertEqual(self.cache.get(key)['content'], "body")
+        
+    def test_no_validators(self):
+        key = self.cache.key("http://example.com/")
+        self.cache.set(key, httplib2.Response({}), "body")
+        self.assertEqual(self.cache.get(key), None)
+    
+    def test_per_user(self):
+        self.assertNotEqual(self.cache.key("http://example.com/", "a"),
+                            self.cache.key("http://example.com/", "b"))
+        
+    def test_eviction(self):
+        response = httplib2.Response({'etag': '"abc"'})
+        for i in range(5):
+            key = self.cache.key(str(i))
+            self.cache.set(key, response, "x" * 400)
+            os.utime(self.cache._path(key), (1000 + i, 1000 + i))
+        self.assert_(self.cache.get(self.cache.key("4")) is not None)
+        self.assertEqual(self.cache.get(self.cache.key("0")), None)
+
+class ConditionalFetchTests(unittest.TestCase):
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.saved, utils.response_cache = utils.response_cache, ResponseCache(self.dir)
+        
+    def tearDown(self):
+        utils.response_cache = self.saved
+        shutil.rmtree(self.dir)
+    
+    def _request(self, status, headers={}):
+        response = httplib2.Response(dict(headers, status=status))
+        return mock.Mock(return_value=(response, "body"))
+        
+    def test_not_modified(self):
+        with mock.patch_object(utils.http_pool, 'request', self._request(200, {'etag': '"abc"'})):
+            self.assertEqual(utils.fetch_resource("http://example.com/", conditional=True), "body")
+        
+        mocked = self._request(304)
+        with mock.patch_object(utils.http_pool, 'request', mocked):
+            self.assertRaises(utils.NotModified, utils.fetch_resource, "http://example.com/", conditional=True)
+            headers = mocked.call_args[0][3]
+            self.assertEqual(headers['if-none-match'], '"abc"')
+    
+    def test_failed_run_forgets_validators(self):
+        utils.start_run()
+        with mock.patch_object(utils.http_pool, 'request', self._request(200, {'etag': '"abc"'})):
+            utils.fetch_resource("http://example.com/", conditional=True)
+        utils.finish_run(success=False)
+        self.assertEqual(utils.response_cache.get(utils.response_cache.key("http://example.com/")), None)
+        
+    def test_failed_run_forgets_batch_validators(self):
+        utils.start_run()
+        with mock.patch_object(utils.http_pool, 'request', self._request(200, {'etag': '"abc"'})):
+            utils.batch([(utils.fetch_resource, (url,), {'conditional': True})
+                         for url in ("http://a.example.com/", "http://b.example.com/")], workers=2)
+        utils.finish_run(success=False)
+        for url in ("http://a.example.com/", "http://b.example.com/"):
+            self.assertEqual(utils.response_cache.get(utils.response_cache.key(url)), None)
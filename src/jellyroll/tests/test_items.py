@@ -1,6 +1,8 @@
+from __future__ import with_statement
+
 from django.test import TestCase
 from jellyroll.models import *
-from tagging.models import Tag
+from tagging.models import Tag, TaggedItem
 from django.contrib.contenttypes.models import ContentType
 from django.conf import settings
 from django import template
@@ -8,6 +10,19 @@ from django import template
 # shortcut
 CT = ContentType.objects.get_for_model
 
+def countQueries(func, *args, **kwargs):
+    """
+    Call ``func``; return its result and the number of queries it ran.
+    """
+    from django.db import connection
+    debug, settings.DEBUG = settings.DEBUG, True
+    connection.queries = []
+    try:
+        result = func(*args, **kwargs)
+        return result, len(connection.queries)
+    finally:
+        settings.DEBUG = debug
+
 class BookmarkTest(TestCase):
     fixtures = ["bookmarks.json"]
         
@@ -15,6 +30,17 @@ class BookmarkTest(TestCase):
         i = Item.objects.get(content_type=CT(Bookmark), object_id="1")
         self.assertEqual(i.url, i.object.url)
         self.assertEqual(i.object_str, str(i.object))
+        
+    def testSaveRefreshesPayload(self):
+        Bookmark.objects.filter(pk=1).update(description="Changed behind the Item's back")
+        i = Item.objects.get(content_type=CT(Bookmark), object_id="1")
+        i.save()
+        self.assertEqual(Item.objects.get(pk=i.pk).payload["description"], "Changed behind the Item's back")
+        
+    def testObjectPK(self):
+        i = Item.objects.get(content_type=CT(Bookmark), object_id="1")
+        self.assertEqual(i.object_pk, 1)
+        self.assertEqual(Item.objects.get_for_object(i.object), i)
             
 class TrackTest(TestCase):
     fixtures = ["tracks.json"]
@@ -23,6 +49,15 @@ class TrackTest(TestCase):
         i = Item.objects.get(content_type=CT(Track), object_id="1")
         self.assertEqual(str(i), "Track: Outkast - The Train (feat. Scar & Sleepy Brown)")
         
+    def testPayload(self):
+        i = Item.objects.get(content_type=CT(Track), object_id="1")
+        self.assertEqual(i.payload, {"artist_name": "Outkast", "track_name": "The Train (feat. Scar & Sleepy Brown)"})
+        
+        t = i.object
+        t.artist_name = "OutKast"
+        t.save()
+        self.assertEqual(Item.objects.get(pk=i.pk).payload["artist_name"], "OutKast")
+        
 class PhotosTest(TestCase):
     fixtures = ["photos.json"]     
     
@@ -33,6 +68,12 @@ class PhotosTest(TestCase):
         i = Item.objects.get(content_type=CT(Photo), object_id="1")
         self.assertEqual(i.url, "http://www.flickr.com/photos/jacobian/1/")
         
+    def testNoObjectPK(self):
+        # Photo IDs are strings, even if they look like numbers.
+        i = Item.objects.get(content_type=CT(Photo), object_id="1")
+        self.assertEqual(i.object_pk, None)
+        self.assertEqual(Item.objects.get_for_object(i.object), i)
+        
     def testImageURLs(self):
         p = Photo.objects.get(pk="1")
         self.assertEqual(p.image_url, "http://static.flickr.com/123/1_1234567890.jpg")
@@ -124,3 +165,348 @@ class ItemTest(TestCase):
         self.assertEqual(Item.objects.models_by_name["video"], Video)
         self.assertEqual(Item.objects.models_by_name["websearch"], WebSearch)
         
+    def testObjectIdFallback(self):
+        # Items from before object_pk existed may not have it filled in.
+        b = Bookmark.objects.get(pk=1)
+        item = Item.objects.get_for_object(b)
+        Item.objects.filter(pk=item.pk).update(object_pk=None)
+        self.assertEqual(Item.objects.get_for_object(b).pk, item.pk)
+        
+        photo = Photo.objects.all()[0]
+        items = Item.objects.get_for_objects([b, photo])
+        self.assertEqual(items[0].pk, item.pk)
+        self.assertEqual(items[1], Item.objects.get_for_object(photo))
+        
+
+class BulkItemTest(TestCase):
+    fixtures = ["bookmarks.json"]
+    
+    def testBulkCreateOrUpdate(self):
+        import datetime
+        existing = Bookmark.objects.get(pk=1)
+        new = Bookmark(url="http://example.com/bulk/", description="Example")
+        when = datetime.datetime(2009, 8, 1, 12, 0)
+        ids = Item.objects.bulk_create_or_update([
+            (existing, dict(timestamp=when, tags="bulk test", source="bulk", source_id="1")),
+            (new, dict(timestamp=when, tags="bulk", source="bulk", source_id="2")),
+        ])
+        self.assertEqual(len(ids), 2)
+        
+        i = Item.objects.get(pk=ids[0])
+        self.assertEqual(i.object, existing)
+        self.assertEqual((i.timestamp, i.source, i.source_id), (when, "bulk", "1"))
+        self.assertEqual(sorted(t.name for t in Tag.objects.get_for_object(i)), ["bulk", "test"])
+        
+        i = Item.objects.get(pk=ids[1])
+        self.assertEqual(i.object, new)
+        self.assertEqual(i.url, "http://example.com/bulk/")
+        self.assertEqual(i.object_pk, new.pk)
+        self.assertEqual(i.object_str, str(new))
+        self.assertEqual([t.name for t in Tag.objects.get_for_object(i)], ["bulk"])
+        
+    def testBulkMatchesCreateOrUpdate(self):
+        b = Bookmark.objects.get(pk=1)
+        single = Item.objects.create_or_update(b, tags="one two", source="s", source_id="x")
+        before = Item.objects.filter(pk=single.pk).values()[0]
+        Item.objects.bulk_create_or_update([(b, dict(tags="one two", source="s", source_id="x"))])
+        after = Item.objects.filter(pk=single.pk).values()[0]
+        self.assertEqual(before, after)
+        
+    def testBulkCreatedElsewhere(self):
+        # Another process creates the Item between our read and our insert.
+        from jellyroll import managers
+        if not managers.can_upsert():
+            return
+        b = Bookmark.objects.get(pk=1)
+        item = Item.objects.get_for_object(b)
+        saved = Item.objects.filter
+        def stale_filter(*args, **kwargs):
+            Item.objects.filter = saved
+            return saved(pk__in=[])
+        Item.objects.filter = stale_filter
+        try:
+            ids = Item.objects.bulk_create_or_update([(b, dict(source="bulk", source_id="1"))])
+        finally:
+            Item.objects.filter = saved
+        self.assertEqual(ids, [item.pk])
+        self.assertEqual(Item.objects.filter(content_type=CT(Bookmark), object_id="1").count(), 1)
+
+class ItemSyncTest(TestCase):
+    fixtures = ["bookmarks.json"]
+    
+    def testCreateOrUpdateUnsaved(self):
+        b = Bookmark(url="http://example.com/unsaved/", description="Unsaved")
+        item = Item.objects.create_or_update(b, source="test")
+        self.assertEqual(list(Item.objects.filter(content_type=CT(Bookmark), object_id=str(b.pk))), [item])
+        self.assertEqual(item.source, "test")
+        
+        # Later saves still sync the Item.
+        b.url = "http://example.com/saved/"
+        b.save()
+        self.assertEqual(Item.objects.get(pk=item.pk).object_str, str(b))
+        
+    def testGuardIsPerThread(self):
+        import threading
+        from jellyroll.managers import _sync_state
+        b = Bookmark.objects.get(pk=1)
+        def saving():
+            _sync_state.__dict__.setdefault('saving', set()).add(id(b))
+        t = threading.Thread(target=saving)
+        t.start()
+        t.join()
+        
+        b.url = "http://example.com/changed/"
+        b.save()
+        self.assertEqual(Item.objects.get(content_type=CT(Bookmark), object_id="1").object_str, str(b))
+
+class SourceKeyTest(TestCase):
+    fixtures = ["bookmarks.json"]
+    
+    def setUp(self):
+        b = Bookmark.objects.get(pk=1)
+        self.item = Item.objects.create_or_update(b, source="test", source_id="abc")
+        
+    def testForSource(self):
+        self.assertEqual(list(Item.objects.for_source("test", "abc")), [self.item])
+        self.assertEqual(list(Item.objects.for_source("test", "xyz")), [])
+        self.assertEqual(list(Item.objects.for_source("other", "abc")), [])
+        
+    def testExistingSourceIds(self):
+        self.assertEqual(Item.objects.existing_source_ids("test", ["abc", "xyz"]), set(["abc"]))
+        self.assertEqual(Item.objects.existing_source_ids("test", []), set())
+
+class IndexTest(TestCase):
+    fixtures = ["bookmarks.json", "photos.json", "tracks.json"]
+    
+    def assertUsesIndex(self, qs, index):
+        from django.db import connection
+        if settings.DATABASE_ENGINE != "sqlite3":
+            return
+        sql, params = qs.query.as_sql()
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        plan = " ".join(str(row[-1]) for row in cursor.fetchall())
+        self.assert_(index in plan, "%r doesn't use %s: %s" % (sql, index, plan))
+    
+    def testTimelineIndexes(self):
+        import datetime
+        start, end = datetime.datetime(2009, 1, 1), datetime.datetime(2009, 2, 1)
+        self.assertUsesIndex(Item.objects.filter(timestamp__range=(start, end)), "jellyroll_item_timestamp")
+        self.assertUsesIndex(Item.objects.get_for_model(Track).order_by('-timestamp')[:1], 
+                             "jellyroll_item_content_type_id_timestamp")
+        self.assertUsesIndex(Item.objects.filter(source="test").order_by('-timestamp')[:1], 
+                             "jellyroll_item_source_timestamp")
+
+class WithObjectsTest(TestCase):
+    fixtures = ["bookmarks.json", "photos.json", "codecommits.json", "tracks.json", "videos.json", "websearches.json"]
+    
+    def testWithObjects(self):
+        expected = [(i.pk, i.object) for i in Item.objects.all()]
+        def fetch():
+            self.items = [(i.pk, i.object, unicode(i)) for i in Item.objects.with_objects()]
+        ctypes = Item.objects.values_list('content_type', flat=True).distinct().count()
+        self.assertEqual(countQueries(fetch)[1], 1 + ctypes)
+        self.assertEqual([(pk, obj) for (pk, obj, s) in self.items], expected)
+        
+    def testRelatedObjects(self):
+        def fetch():
+            for i in Item.objects.get_for_model(CodeCommit).with_objects():
+                i.object.repository.name
+        self.assertEqual(countQueries(fetch)[1], 2)
+
+class UpsertTest(TestCase):
+    fixtures = ["bookmarks.json"]
+    
+    def _upsert(self, description):
+        from jellyroll.managers import upsert
+        return upsert(Bookmark, dict(url="http://example.com/upsert/"), 
+                      dict(description=description), update=["description"])[0]
+    
+    def testUpsert(self):
+        b = self._upsert("First")
+        self.assertEqual(Bookmark.objects.get(pk=b.pk).description, "First")
+        b2 = self._upsert("Second")
+        self.assertEqual(b2.pk, b.pk)
+        self.assertEqual(b2.description, "Second")
+        self.assertEqual(Bookmark.objects.filter(url="http://example.com/upsert/").count(), 1)
+        
+    def testUnchanged(self):
+        from jellyroll.managers import upsert
+        args = (Bookmark, dict(url="http://example.com/upsert/"), dict(description="Same"), ["description"])
+        b, written = upsert(*args)
+        self.assert_(written)
+        b2, written = upsert(*args)
+        self.failIf(written)
+        self.assertEqual((b2.pk, b2.description), (b.pk, "Same"))
+        
+    def testFallback(self):
+        import mock
+        from jellyroll import managers
+        with_upsert = self._upsert("First")
+        mocked = mock.Mock(return_value=False)
+        saved, managers.can_upsert = managers.can_upsert, mocked
+        try:
+            b = self._upsert("Second")
+            item = Item.objects.create_or_update(b, source="fallback")
+        finally:
+            managers.can_upsert = saved
+        self.assert_(mocked.called)
+        self.assertEqual((b.pk, b.description), (with_upsert.pk, "Second"))
+        self.assertEqual(Item.objects.get(pk=item.pk).source, "fallback")
+        
+    def testCreateOrUpdate(self):
+        import datetime
+        b = Bookmark.objects.get(pk=1)
+        when = datetime.datetime(2009, 1, 2, 3, 4, 5)
+        item = Item.objects.create_or_update(b, timestamp=when, tags="a b", source="upsert")
+        self.assertEqual((item.timestamp, item.tags, item.source), (when, "a b", "upsert"))
+        self.assertEqual(Item.objects.filter(content_type=CT(Bookmark), object_id="1").count(), 1)
+        self.assertEqual(sorted(t.name for t in Tag.objects.get_for_object(item)), ["a", "b"])
+
+class TagSyncTest(TestCase):
+    fixtures = ["bookmarks.json"]
+    
+    def setUp(self):
+        self.item = Item.objects.get(content_type=CT(Bookmark), object_id="1")
+        
+    def _tags(self, item):
+        return sorted(t.name for t in Tag.objects.get_for_object(item))
+        
+    def testSyncTags(self):
+        Item.objects.sync_tags(self.item, "one two three")
+        self.assertEqual(self._tags(self.item), ["one", "three", "two"])
+        kept = TaggedItem.objects.get(content_type=CT(Item), object_id=self.item.pk, tag__name="two").pk
+        Item.objects.sync_tags(self.item.pk, "two four")
+        self.assertEqual(self._tags(self.item), ["four", "two"])
+        self.assertEqual(TaggedItem.objects.get(content_type=CT(Item), object_id=self.item.pk, tag__name="two").pk, kept)
+        
+    def testBulkSyncTags(self):
+        other = Item.objects.create_or_update(Bookmark(url="http://example.com/tagsync/"))
+        Item.objects.bulk_sync_tags({self.item.pk: "a b", other.pk: "b c"})
+        self.assertEqual(self._tags(self.item), ["a", "b"])
+        self.assertEqual(self._tags(other), ["b", "c"])
+        self.assertEqual(Tag.objects.filter(name="b").count(), 1)
+        
+    def testTagCreatedElsewhere(self):
+        # A Tag that appears between looking tags up and creating them.
+        import mock
+        existing = Tag.objects.create(name="racy")
+        mocked = mock.Mock(return_value=Tag.objects.none())
+        saved, Tag.objects.filter = Tag.objects.filter, mocked
+        try:
+            ids = Item.objects._tag_ids(["racy", "fresh"])
+        finally:
+            Tag.objects.filter = saved
+        self.assert_(mocked.called)
+        self.assertEqual(ids["racy"], existing.pk)
+        self.assertEqual(ids["fresh"], Tag.objects.get(name="fresh").pk)
+        
+    def testSaveOnlySyncsChanges(self):
+        import mock
+        self.item.tags = "x y"
+        self.item.save()
+        self.assertEqual(self._tags(self.item), ["x", "y"])
+        
+        item = Item.objects.get(pk=self.item.pk)
+        mocked = mock.Mock()
+        saved, Item.objects.sync_tags = Item.objects.sync_tags, mocked
+        try:
+            item.save()
+        finally:
+            Item.objects.sync_tags = saved
+        self.failIf(mocked.called)
+
+class DeferredSyncTest(TestCase):
+    fixtures = ["bookmarks.json"]
+    
+    def testDeferredSync(self):
+        import mock
+        b = Bookmark.objects.get(pk=1)
+        mocked = mock.Mock(wraps=Item.objects.create_or_update)
+        saved, Item.objects.create_or_update = Item.objects.create_or_update, mocked
+        try:
+            with Item.objects.deferred_sync():
+                with Item.objects.deferred_sync():
+                    b.url = "http://example.com/deferred/1/"
+                    b.save()
+                b.url = "http://example.com/deferred/2/"
+                b.save()
+                new = Bookmark.objects.create(url="http://example.com/deferred/new/")
+                self.assertEqual(Item.objects.get_for_object(b).object_str, "http://example.com/")
+                self.assertRaises(Item.DoesNotExist, Item.objects.get_for_object, new)
+        finally:
+            Item.objects.create_or_update = saved
+        self.failIf(mocked.called)
+        self.assertEqual(Item.objects.get_for_object(b).object_str, "http://example.com/deferred/2/")
+        self.assertEqual(Item.objects.get_for_object(new).object_str, "http://example.com/deferred/new/")
+        
+    def testDroppedOnError(self):
+        b = Bookmark.objects.get(pk=1)
+        try:
+            with Item.objects.deferred_sync():
+                b.url = "http://example.com/deferred/error/"
+                b.save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertNotEqual(Item.objects.get_for_object(b).object_str, b.url)
+        
+        # Syncing goes back to normal afterwards.
+        b.save()
+        self.assertEqual(Item.objects.get_for_object(b).object_str, b.url)
+
+class TimelineBoundsTest(TestCase):
+    fixtures = ["bookmarks.json", "photos.json"]
+    
+    def setUp(self):
+        from django.core.cache import cache
+        from jellyroll.managers import _bounds_key
+        cache.delete(_bounds_key(None))
+        for model in Item.objects.models_by_name.values():
+            cache.delete(_bounds_key(CT(model).pk))
+        
+    def _bounds(self, qs):
+        qs = qs.order_by("timestamp")
+        return (qs[0].timestamp, qs.reverse()[0].timestamp)
+        
+    def testBounds(self):
+        self.assertEqual(Item.objects.timeline_bounds(), self._bounds(Item.objects.all()))
+        self.assertEqual(Item.objects.timeline_bounds(Photo), self._bounds(Item.objects.get_for_model(Photo)))
+        Item.objects.get_for_model(Track).delete()
+        self.assertEqual(Item.objects.timeline_bounds(Track), None)
+        
+    def testMaintained(self):
+        import datetime
+        Item.objects.timeline_bounds()
+        first, last = Item.objects.timeline_bounds(Bookmark)
+        
+        # Items inside the bounds leave them alone...
+        inside = first + (last - first) / 2
+        item = Item.objects.create_or_update(Bookmark(url="http://example.com/bounds/inside/"), timestamp=inside)
+        def fetch():
+            Item.objects.timeline_bounds()
+            Item.objects.timeline_bounds(Bookmark)
+        self.assertEqual(countQueries(fetch)[1], 0)
+        
+        # ...and ones outside them get them looked up again.
+        when = datetime.datetime(1990, 1, 1)
+        item = Item.objects.create_or_update(Bookmark(url="http://example.com/bounds/"), timestamp=when)
+        self.assertEqual(Item.objects.timeline_bounds()[0], when)
+        self.assertEqual(Item.objects.timeline_bounds(Bookmark)[0], when)
+            
+        item.delete()
+        self.assertEqual(Item.objects.timeline_bounds(), self._bounds(Item.objects.all()))
+
+class SyncStateTest(TestCase):
+    
+    def testAdvanceAware(self):
+        import datetime
+        from jellyroll.providers.utils import dates
+        state = SyncState.objects.create(provider="test")
+        state.advance(dates.parse("2009-08-18T15:30:16Z"))
+        state = SyncState.objects.get(provider="test")
+        self.assertEqual(state.last_timestamp, dates.parsedate("2009-08-18T15:30:16Z"))
+        
+        # Only ever forwards, comparing like with like.
+        state.advance(dates.parse("2009-08-18T15:00:00Z"))
+        self.assertEqual(state.last_timestamp, dates.parsedate("2009-08-18T15:30:16Z"))
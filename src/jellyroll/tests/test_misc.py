@@ -1,3 +1,6 @@
+from __future__ import with_statement
+
+import mock
 import unittest
 import jellyroll.providers
 
@@ -17,4 +20,26 @@ class MiscTests(unittest.TestCase):
         ]
         expanded.sort()
         expected.sort()
-        self.assertEqual(expanded, expected)
\ No newline at end of file
+        self.assertEqual(expanded, expected)
+
+class ProviderUpdateTests(unittest.TestCase):
+    def setUp(self):
+        self.good = mock.Mock()
+        self.bad = mock.Mock()
+        self.bad.update.side_effect = ValueError("boom")
+        self.active = {'good': self.good, 'bad': self.bad}
+
+    def _update(self, jobs):
+        mocked = mock.Mock(return_value=self.active)
+        with mock.patch_object(jellyroll.providers, 'active_providers', mocked):
+            jellyroll.providers.update(None, jobs=jobs)
+
+    def test_update_serial(self):
+        self._update(jobs=1)
+        self.assert_(self.good.update.called)
+        self.assert_(self.bad.update.called)
+
+    def test_update_concurrent(self):
+        self._update(jobs=2)
+        self.assert_(self.good.update.called)
+        self.assert_(self.bad.update.called)
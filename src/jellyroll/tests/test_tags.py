@@ -1,6 +1,10 @@
 from django import template
+from django.conf import settings
 from django.test import TestCase
+from django.utils.html import escape
+from django.contrib.contenttypes.models import ContentType
 from jellyroll.models import *
+from jellyroll.tests.test_items import countQueries
 
 class TagTestCase(TestCase):
     """Helper class with some tag helper functions"""
@@ -33,7 +37,44 @@ class RenderTagTest(TagTestCase):
         i = Item.objects.get(pk=1)
         o = self.renderTemplate('{% load jellyroll %}{% jellyrender i as o using "jellyroll/snippets/item.txt" %} -- {{ o }}', i=i)
         self.assertEqual(" -- %s" % str(i.object), o)
+        
+    def testRenderObject(self):
+        i = Item.objects.get(pk=1)
+        o = self.renderTemplate('{% load jellyroll %}{% jellyrender o using "jellyroll/snippets/item.txt" %}', o=i.object)
+        self.assertEqual(str(i.object), o)
+        
+    def testRenderList(self):
+        items = list(Item.objects.all())
+        objects = [i.object for i in items]
+        expected = "".join(self.renderTemplate('{% load jellyroll %}{% jellyrender i %}', i=i) for i in items)
+        o, queries = countQueries(self.renderTemplate, "{% load jellyroll %}{% jellyrender_list objects %}", objects=objects)
+        self.assertEqual(queries, len(set(type(o) for o in objects)))
+        self.assertEqual(o, expected)
+        
+    def testRenderListAs(self):
+        i = Item.objects.get(pk=1)
+        o = self.renderTemplate('{% load jellyroll %}{% jellyrender_list l using "jellyroll/snippets/item.txt" as o %}[{{ o }}]', l=[i, i])
+        self.assertEqual("[%s%s]" % (i.object, i.object), o)
 
+class SnippetTest(TagTestCase):
+    fixtures = ["photos.json", "videos.json"]
+    
+    def setUp(self):
+        self.installTagLibrary('jellyroll.templatetags.jellyroll')
+        
+    def testFromItemAlone(self):
+        # The shipped snippets only need the Item, not its object.
+        for i in Item.objects.all():
+            i.content_type
+            o, queries = countQueries(self.renderTemplate, "{% load jellyroll %}{% jellyrender i %}", i=i)
+            self.assertEqual(queries, 0)
+            self.assert_(escape(i.payload.get("title") or i.object_str) in o, o)
+            
+    def testPhotoSnippet(self):
+        i = Item.objects.get_for_model(Photo)[0]
+        o = self.renderTemplate("{% load jellyroll %}{% jellyrender i %}", i=i)
+        self.assert_('<img src="%s"' % i.object.square_url in o, o)
+        
 class GetJellyrollItemsTagSyntaxTest(TestCase):
     
     def getNode(self, str):
@@ -89,6 +130,23 @@ class GetJellyrollItemsTagSyntaxTest(TestCase):
         self.assertNodeException("get_jellyroll_items oftype")
         self.assertNodeException("get_jellyroll_items excludetype")
         
+    def testCached(self):
+        node = self.getNode("get_jellyroll_items limit 10 cached 60 as items")
+        self.assertEqual(node.cached, 60)
+        self.assertNodeException("get_jellyroll_items limit 10 cached soon as items")
+        
+    def testTypeIds(self):
+        import mock
+        mocked = mock.Mock()
+        saved, ContentType.objects.get_for_model = ContentType.objects.get_for_model, mocked
+        try:
+            node = self.getNode("get_jellyroll_items oftype video excludetype photo limit 10 as items")
+        finally:
+            ContentType.objects.get_for_model = saved
+        self.failIf(mocked.called)
+        CT = ContentType.objects.get_for_model
+        self.assertEqual(node.type_ids(), ([CT(Video).id], [CT(Photo).id]))
+
     def testInvalidTypes(self):
         self.assertNodeException("get_jellyroll_items limit 10 oftype frog as items")
         self.assertNodeException("get_jellyroll_items limit 10 excludetype frog as items")
@@ -149,3 +207,150 @@ class GetJellyrollItemsTagTest(TagTestCase):
                                 "{% get_jellyroll_items excludetype photo excludetype video limit 10 as items %}"\
                                 "{{ items|length }}")
         self.assertEqual(o, "3")
+        
+    def testLazy(self):
+        t = template.Template("{% load jellyroll %}{% get_jellyroll_items limit 10 as items %}")
+        c = template.Context()
+        self.assertEqual(countQueries(t.render, c)[1], 0)
+        self.assertEqual(len(list(c["items"])), 10)
+        self.assertEqual(c["items"][0], Item.objects.order_by("-timestamp")[0])
+        
+    def testListLike(self):
+        items = list(Item.objects.order_by("-timestamp")[:5])
+        o = self.renderTemplate("{% load jellyroll %}"\
+                                "{% get_jellyroll_items limit 5 as items %}"\
+                                "{{ items|last }}|{{ items|slice:\"-2:\"|length }}")
+        self.assertEqual(o, "%s|2" % items[-1])
+        
+        # The query only runs once, however often the items get used.
+        t = "{% load jellyroll %}"\
+            "{% get_jellyroll_items oftype bookmark limit 5 as items %}"\
+            "{% if items %}{{ items|length }}{% endif %}"\
+            "{% for i in items %}{{ i.id }}{% endfor %}"\
+            "{% for i in items %}{{ i.id }}{% endfor %}"
+        o, queries = countQueries(self.renderTemplate, t)
+        ids = [str(i.id) for i in Item.objects.get_for_model(Bookmark).order_by("-timestamp")[:5]]
+        self.assertEqual(o, "%s%s%s" % (len(ids), "".join(ids), "".join(ids)))
+        self.assertEqual(queries, 2)
+        
+    def testLoopTwice(self):
+        t = template.Template("{% load jellyroll %}{% get_jellyroll_items limit 5 as items %}")
+        c = template.Context()
+        t.render(c)
+        first, queries = countQueries(lambda: [i.id for i in c["items"]])
+        self.assert_(queries > 0)
+        self.assertEqual(countQueries(lambda: [i.id for i in c["items"]]), (first, 0))
+        self.assertEqual(countQueries(lambda: (len(c["items"]), c["items"][-1].id)), ((5, first[-1]), 0))
+            
+    def testCached(self):
+        t = "{% load jellyroll %}{% get_jellyroll_items oftype photo limit 10 cached 60 as items %}{{ items|length }}"
+        self.assertEqual(self.renderTemplate(t), "5")
+        self.assertEqual(countQueries(self.renderTemplate, t), ("5", 0))
+            
+        # New Items invalidate the cached items.
+        Item.objects.get_for_model(Photo)[0].delete()
+        self.assertEqual(self.renderTemplate(t), "4")
+
+class RecentTrafficTagTest(TagTestCase):
+    fixtures = ["bookmarks.json", "photos.json"]
+    
+    def setUp(self):
+        import datetime
+        self.installTagLibrary('jellyroll.templatetags.jellyroll')
+        today = datetime.datetime.combine(datetime.date.today(), datetime.time())
+        self.days_ago = lambda n: today - datetime.timedelta(days=n) + datetime.timedelta(hours=12)
+        for i, n in enumerate([1, 1, 3]):
+            Item.objects.create_or_update(Bookmark(url="http://example.com/traffic/%s/" % i), timestamp=self.days_ago(n))
+        
+    def render(self, types=""):
+        return self.renderTemplate("{% load jellyroll %}"\
+                                   "{% get_jellyroll_recent_traffic 4 as traffic " + types + " %}"\
+                                   "{{ traffic }}")
+        
+    def testTraffic(self):
+        self.assertEqual(self.render(), "[2, 0, 1, 0]")
+        o = self.renderTemplate("{% load jellyroll %}"\
+                                "{% get_jellyroll_recent_traffic 4 as traffic bookmark,photo %}"\
+                                "{{ traffic.bookmark }} {{ traffic.photo }}")
+        self.assertEqual(o, "[2, 0, 1, 0] [0, 0, 0, 0]")
+        
+    def testCached(self):
+        self.render()
+        self.assertEqual(countQueries(self.render), ("[2, 0, 1, 0]", 0))
+            
+        # New Items invalidate the cached counts.
+        Item.objects.create_or_update(Bookmark(url="http://example.com/traffic/new/"), timestamp=self.days_ago(2))
+        self.assertEqual(self.render(), "[2, 1, 1, 0]")
+        
+    def testInvalidType(self):
+        self.assertRaises(template.TemplateSyntaxError, self.render, "frog")
+
+class PrerenderTest(TagTestCase):
+    fixtures = ["bookmarks.json"]
+    
+    def setUp(self):
+        from django.conf import settings
+        self.installTagLibrary('jellyroll.templatetags.jellyroll')
+        settings.JELLYROLL_PRERENDER = True
+        
+    def tearDown(self):
+        from django.conf import settings
+        del settings.JELLYROLL_PRERENDER
+        if hasattr(settings, "JELLYROLL_SNIPPET_VERSION"):
+            del settings.JELLYROLL_SNIPPET_VERSION
+        
+    def testRenderedAtIngest(self):
+        b = Bookmark.objects.create(url="http://example.com/prerender/")
+        i = Item.objects.get_for_object(b)
+        self.assertEqual(i.rendered_version, "1")
+        self.assertEqual(i.rendered_text, "http://example.com/prerender/")
+        self.assert_(i.rendered_html.startswith('<div class="jellyroll-item'), i.rendered_html)
+        
+    def testItemSave(self):
+        from django.conf import settings
+        b = Bookmark.objects.create(url="http://example.com/prerender/")
+        i = Item.objects.get_for_object(b)
+        i.url = "http://example.com/prerender/edited/"
+        i.save()
+        self.assert_(i.url in i.rendered_html, i.rendered_html)
+        self.assert_(i.url in Item.objects.get(pk=i.pk).rendered_html)
+        
+        # Without JELLYROLL_PRERENDER, saving just clears the stored snippets.
+        settings.JELLYROLL_PRERENDER = False
+        i.save()
+        self.assertEqual(Item.objects.get(pk=i.pk).rendered_version, "")
+        
+    def testChangedWhileOff(self):
+        from django.conf import settings
+        b = Bookmark.objects.create(url="http://example.com/prerender/")
+        settings.JELLYROLL_PRERENDER = False
+        b.url = "http://example.com/prerender/single/"
+        b.save()
+        self.assertEqual(Item.objects.get_for_object(b).rendered_version, "")
+        
+        Item.objects.filter(pk=Item.objects.get_for_object(b).pk).update(rendered_text="stale", rendered_version="1")
+        Bookmark.objects.filter(pk=b.pk).update(url="http://example.com/prerender/bulk/")
+        b = Bookmark.objects.get(pk=b.pk)
+        Item.objects.bulk_create_or_update([(b, {})])
+        self.assertEqual(Item.objects.get_for_object(b).rendered_version, "")
+        
+        settings.JELLYROLL_PRERENDER = True
+        i = Item.objects.get_for_object(b)
+        self.assertEqual(self.renderTemplate("{% load jellyroll %}{% jellyrender i using \"jellyroll/snippets/item.txt\" %}", i=i), b.url)
+        
+    def testServedFromItem(self):
+        from django.conf import settings
+        b = Bookmark.objects.create(url="http://example.com/prerender/")
+        Item.objects.filter(pk=Item.objects.get_for_object(b).pk).update(rendered_html="stored")
+        render = lambda: self.renderTemplate("{% load jellyroll %}{% jellyrender i %}", i=Item.objects.get_for_object(b))
+        self.assertEqual(render(), "stored")
+        
+        # A new snippet version makes the stored snippets stale...
+        settings.JELLYROLL_SNIPPET_VERSION = 2
+        self.assertNotEqual(render(), "stored")
+        
+        # ... until they're re-rendered.
+        from django.core.management import call_command
+        call_command("jellyroll_render", verbosity="0")
+        self.assertEqual(Item.objects.get_for_object(b).rendered_version, "2")
+        self.assertEqual(Item.objects.filter(rendered_version="1").count(), 0)
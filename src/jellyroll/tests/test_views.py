@@ -51,4 +51,19 @@ class CalendarViewTest(TestCase):
         today, response, context = self.callView("/")
         first = context["items"][0].timestamp
         last = list(context["items"])[-1].timestamp
-        self.assert_(first > last, "first: %s, last: %s" % (first, last))
\ No newline at end of file
+        self.assert_(first > last, "first: %s, last: %s" % (first, last))
+        
+    def testPlainQuerySet(self):
+        from django.db.models.query import QuerySet
+        from django.http import HttpRequest
+        from jellyroll.views import calendar
+        today = datetime.date.today()
+        request = HttpRequest()
+        request.method = "GET"
+        for queryset in (Item.objects.none(), QuerySet(Item)):
+            response = calendar.year(request, str(today.year), queryset=queryset)
+            self.assertEqual(response.status_code, 200)
+            response = calendar.month(request, str(today.year), today.strftime("%b").lower(), queryset=queryset)
+            self.assertEqual(response.status_code, 200)
+            response = calendar.day(request, str(today.year), today.strftime("%b").lower(), today.strftime("%d"), queryset=queryset)
+            self.assertEqual(response.status_code, 200)
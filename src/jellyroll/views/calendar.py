@@ -59,18 +59,18 @@ def year(request, year, queryset=None,
     """
     # Make sure we've requested a valid year
     year = int(year)
-    try:
-        first = Item.objects.order_by("timestamp")[0]
-    except IndexError:
+    bounds = Item.objects.timeline_bounds()
+    if bounds is None:
         raise Http404("No items; no views.")
+    first = bounds[0]
     today = datetime.date.today()
-    if year < first.timestamp.year or year > today.year:
-        raise Http404("Invalid year (%s .. %s)" % (first.timestamp.year, today.year))
+    if year < first.year or year > today.year:
+        raise Http404("Invalid year (%s .. %s)" % (first.year, today.year))
     
     # Calculate the previous year
     previous = year - 1
     previous_link = urlresolvers.reverse("jellyroll.views.calendar.year", args=[previous])
-    if previous < first.timestamp.year:
+    if previous < first.year:
         previous = previous_link = None
     
     # And the next year
@@ -80,15 +80,17 @@ def year(request, year, queryset=None,
         next = next_link = None
         
     # Handle the initial queryset
-    if not queryset:
+    if queryset is None:
         queryset = Item.objects.all()
+    if hasattr(queryset, "with_objects"):
+        queryset = queryset.with_objects()
     queryset = queryset.filter(timestamp__year=year)
     if not queryset.query.order_by:
         queryset = queryset.order_by("timestamp")
         
     # Build the context
     context = RequestContext(request, {
-        "items"         : queryset.filter(timestamp__year=year).order_by("timestamp"),
+        "items"         : queryset,
         "year"          : year,
         "previous"      : previous,
         "previous_link" : previous_link,
@@ -141,10 +143,10 @@ def month(request, year, month, queryset=None,
         date = datetime.date(*time.strptime(year+month, '%Y%b')[:3])
     except ValueError:
         raise Http404("Invalid month string")
-    try:
-        first = Item.objects.order_by("timestamp")[0]
-    except IndexError:
+    bounds = Item.objects.timeline_bounds()
+    if bounds is None:
         raise Http404("No items; no views.")
+    first = bounds[0]
     
     # Calculate first and last day of month, for use in a date-range lookup.
     today = datetime.date.today()
@@ -154,13 +156,13 @@ def month(request, year, month, queryset=None,
     else:
         last_day = first_day.replace(month=first_day.month + 1)
     
-    if first_day < first.timestamp.date().replace(day=1) or date > today:
-        raise Http404("Invalid month (%s .. %s)" % (first.timestamp.date(), today))
+    if first_day < first.date().replace(day=1) or date > today:
+        raise Http404("Invalid month (%s .. %s)" % (first.date(), today))
     
     # Calculate the previous month
     previous = (first_day - datetime.timedelta(days=1)).replace(day=1)
     previous_link = urlresolvers.reverse("jellyroll.views.calendar.month", args=previous.strftime("%Y %b").lower().split())
-    if previous < first.timestamp.date().replace(day=1):
+    if previous < first.date().replace(day=1):
         previous = None
     
     # And the next month
@@ -170,8 +172,10 @@ def month(request, year, month, queryset=None,
         next = None
         
     # Handle the initial queryset
-    if not queryset:
+    if queryset is None:
         queryset = Item.objects.all()
+    if hasattr(queryset, "with_objects"):
+        queryset = queryset.with_objects()
     queryset = queryset.filter(timestamp__range=(first_day, last_day))
     if not queryset.query.order_by:
         queryset = queryset.order_by("timestamp")
@@ -236,19 +240,19 @@ def day(request, year, month, day, queryset=None, recent_first=False,
         day = datetime.date(*time.strptime(year+month+day, '%Y%b%d')[:3])
     except ValueError:
         raise Http404("Invalid day string")
-    try:
-        first = Item.objects.order_by("timestamp")[0]
-    except IndexError:
+    bounds = Item.objects.timeline_bounds()
+    if bounds is None:
         raise Http404("No items; no views.")
+    first = bounds[0]
     
     today = datetime.date.today()
-    if day < first.timestamp.date() or day > today:
-        raise Http404("Invalid day (%s .. %s)" % (first.timestamp.date(), today))
+    if day < first.date() or day > today:
+        raise Http404("Invalid day (%s .. %s)" % (first.date(), today))
     
     # Calculate the previous day
     previous = day - datetime.timedelta(days=1)
     previous_link = urlresolvers.reverse("jellyroll.views.calendar.day", args=previous.strftime("%Y %b %d").lower().split())
-    if previous < first.timestamp.date():
+    if previous < first.date():
         previous = previous_link = None
     
     # And the next month
@@ -262,8 +266,10 @@ def day(request, year, month, day, queryset=None, recent_first=False,
                        datetime.datetime.combine(day, datetime.time.max))
     
     # Handle the initial queryset
-    if not queryset:
-       queryset = Item.objects.all()
+    if queryset is None:
+        queryset = Item.objects.all()
+    if hasattr(queryset, "with_objects"):
+        queryset = queryset.with_objects()
     queryset = queryset.filter(timestamp__range=timestamp_range)
     if not queryset.query.order_by:
         if recent_first: